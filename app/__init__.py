@@ -15,6 +15,7 @@ from config import settings
 from dynaconf import FlaskDynaconf
 from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 ascii_logo = """
  _       ___       ______     __  __       
@@ -73,8 +74,14 @@ class PrefixLoggerAdapter(logging.LoggerAdapter):
 
 def create_app():
     app = Flask(__name__)
+    from app.json_provider import FastJSONProvider
+    app.json = FastJSONProvider(app)
     
     app.config.from_object(settings)
+    proxy_count = int(app.config.get("PROXY_COUNT", 0))
+    if proxy_count:
+        # Without this URLs are built for the proxy's address and scheme instead of the client's
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_count, x_proto=proxy_count, x_host=proxy_count)
     app.register_error_handler(404, page_not_found)
     app.register_error_handler(500, internal_server_error)
 
@@ -83,6 +90,8 @@ def create_app():
     migrate.init_app(app, db)
     htmx.init_app(app)
     dynaconf.init_app(app)
+    from app.settings import load_config_overrides
+    load_config_overrides(app)
     bcrypt.init_app(app)
 
     login_manager.login_view = 'auth.login'
@@ -103,6 +112,30 @@ def create_app():
     app.register_blueprint(winget, url_prefix='/wg')
     app.register_blueprint(auth)
 
+    from app.cache import download_cache, manifest_cache
+    manifest_cache.init_app(app, "MANIFEST_CACHE_SIZE")
+    download_cache.init_app(app)
+
+    from app.search import search_index
+    search_index.init_app(app)
+
+    from app.uplink import uplink
+    uplink.init_app(app)
+
+    from app.installer_cache import installer_cache
+    installer_cache.init_app(app)
+
+    from app.download_counter import download_counter
+    download_counter.init_app(app)
+
+    from app.s3 import presigned_urls
+    presigned_urls.init_app(app)
+
+    from app.mirror import mirror_cli, start_mirror_job
+    app.cli.add_command(mirror_cli)
+    from app.preindexed import preindexed_cli, start_preindexed_job
+    app.cli.add_command(preindexed_cli)
+
     app.jinja_env.filters['sort_versions'] = sort_versions
     app.jinja_env.filters['remove_none_values'] = remove_none_values
 
@@ -130,9 +163,8 @@ def create_app():
     app.add_template_global(constants.installer_scopes, name='installer_scopes')
     app.add_template_global(constants.simplified_nested_installer_types, name='nested_installer_types')
 
-    def get_settings():
-        return {setting.key.upper(): setting.get_value() for setting in Setting.query.all()}
-    
+    from app.settings import get_settings
+
     @app.context_processor
     def inject_settings():
         return dict(global_settings=get_settings())
@@ -153,6 +185,8 @@ def create_app():
             create_all()
             from app.settings import create_all
             create_all()
+        start_mirror_job(app)
+        start_preindexed_job(app)
 
         
 
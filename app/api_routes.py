@@ -1,5 +1,8 @@
 import os
-import boto3
+from collections import namedtuple
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
 from flask import (
     Blueprint,
     Response,
@@ -10,16 +13,14 @@ from flask import (
     stream_with_context,
     url_for,
     current_app,
-    send_from_directory,
     flash,
 )
 from flask_login import current_user, login_required
-from werkzeug.http import parse_range_header
 from werkzeug.utils import secure_filename
 import requests
 from app import db
 from app.decorators import permission_required
-from app.forms import AddInstallerForm, AddPackageForm, AddVersionForm
+from app.forms import AddInstallerForm, AddPackageForm, AddVersionForm, NegotiateInstallerForm
 from app.models import (
     InstallerSwitch,
     Package,
@@ -30,11 +31,19 @@ from app.models import (
     Setting,
     User,
 )
-from app.utils import create_installer, save_file, basedir, delete_installer_util
+from app.blob_store import blob_store, is_stored
+from app.cache import download_cache, manifest_cache
+from app.download_counter import download_counter
+from app.download_stats import PERIODS, download_trend
+from app.file_response import send_installer
+from app.installer_cache import installer_cache
+from app.s3 import presigned_urls, s3_client
+from app.search import search_index
+from app.settings import get_config, get_setting, settings_cache
+from app.utils import build_installer, create_installer, s3_upload_key
 from app.constants import installer_switches
 
 api = Blueprint("api", __name__)
-s3_client = boto3.client("s3")
 
 
 @api.route("/")
@@ -55,17 +64,12 @@ def packages():
     query = Package.query
 
     if search_query:
-        search = "%{}%".format(search_query)
         query = query.filter(
-            db.or_(
-                Package.name.ilike(search),
-                Package.identifier.ilike(search),
-                Package.publisher.ilike(search)
-            )
+            search_index.match(search_query, ["name", "identifier", "publisher"])
         )
 
     paginated_packages = query.paginate(page=page,per_page=per_page,error_out=False)
-    packages = paginated_packages.items
+    packages = Package.load_manifests(paginated_packages.items)
 
     return jsonify({
         'packages': [package.to_dict() for package in packages],
@@ -79,10 +83,11 @@ def packages():
 @permission_required("view:package")
 def package(identifier):
     # Use identifier and check if its the id or the package identifier
+    query = Package.query.options(*Package.manifest_options())
     if identifier.isdigit():
-        package = Package.query.get(identifier)
+        package = query.get(identifier)
     else:
-        package = Package.query.filter_by(identifier=identifier).first()
+        package = query.filter_by(identifier=identifier).first()
     if package is None:
         return "Package not found", 404
     return jsonify(package.to_dict())
@@ -97,6 +102,55 @@ def package_versions(identifier):
         return "Package not found", 404
     return jsonify([version.to_dict() for version in package.versions])
 
+@api.get("/package/<identifier>/downloads")
+@login_required
+@permission_required("view:package")
+def package_downloads(identifier):
+    """Download trend of a package, optionally for one version or architecture and split by either."""
+    package = Package.query.filter_by(identifier=identifier).first()
+    if package is None:
+        return "Package not found", 404
+
+    period = request.args.get("period", "hour")
+    group_by = request.args.get("group_by")
+    if period not in PERIODS or group_by not in (None, "version", "architecture"):
+        return "Invalid period or group_by", 400
+    try:
+        until = datetime.fromisoformat(request.args["until"]) if "until" in request.args else None
+        since = (
+            datetime.fromisoformat(request.args["since"])
+            if "since" in request.args
+            else datetime.utcnow() - timedelta(days=7)
+        )
+    except ValueError:
+        return "Invalid since or until, use ISO 8601", 400
+
+    versions = {version.id: version.version_code for version in package.versions}
+    version_ids = None
+    if "version" in request.args:
+        version_ids = [id for id, code in versions.items() if code == request.args["version"]]
+
+    series = download_trend(
+        package.id,
+        period=period,
+        since=since,
+        until=until,
+        version_ids=version_ids,
+        architecture=request.args.get("architecture"),
+        group_by="version_id" if group_by == "version" else group_by,
+    )
+    return jsonify({
+        "period": period,
+        "series": [
+            {
+                # Versions that were deleted since keep their downloads under a null key
+                "key": versions.get(key) if group_by == "version" else key,
+                "data": [{"bucket": bucket.isoformat(), "count": count} for bucket, count in data],
+            }
+            for key, data in series.items()
+        ],
+    })
+
 @api.get("/package/<identifier>/version/<version>")
 @login_required
 @permission_required("view:version")
@@ -168,13 +222,13 @@ def generate_presigned_url():
             "installer-installer_scope"
         )  # Add this to the request form
         # Define the S3 object key with the same format as 'scope.file_extension'
-        s3_object_key = f"packages/{publisher}/{identifier}/{version}/{architecture}/{scope}.{file_extension}"
+        s3_object_key = s3_upload_key(publisher, identifier, version, architecture, f"{scope}.{file_extension}")
 
         # Generate a pre-signed URL for S3 uploads
         presigned_url = s3_client.generate_presigned_url(
             "put_object",
             Params={
-                "Bucket": Setting.get("bucket_name").get_value(),
+                "Bucket": get_setting("BUCKET_NAME"),
                 "Key": s3_object_key,
                 "ContentType": content_type,
             },
@@ -214,7 +268,9 @@ def add_package():
     external_url = installer_form.url.data
     is_aws = installer_form.is_aws.data
 
-    package = Package(identifier=identifier, name=name, publisher=publisher)
+    package = Package(identifier=identifier, name=name, publisher=publisher, moniker=form.moniker.data or None)
+    package.set_tags(tag.strip() for tag in (form.tags.data or "").split(","))
+    search_index.update(package)
 
     if file or external_url and version:
         current_app.logger.info("File and version found")
@@ -238,6 +294,7 @@ def add_package():
     try:
         db.session.add(package)
         db.session.commit()
+        manifest_cache.invalidate()
         current_app.logger.info(f"Package {package.identifier} added successfully")
     except Exception as e:
         db.session.rollback()
@@ -259,7 +316,15 @@ def update_package(identifier):
     publisher = request.form["publisher"]
     package.name = name
     package.publisher = publisher
+    if "moniker" in request.form:
+        package.moniker = request.form["moniker"].strip() or None
+    if "tags" in request.form:
+        package.set_tags(tag.strip() for tag in request.form["tags"].split(","))
+    package.touch()
+    search_index.update(package)
     db.session.commit()
+    manifest_cache.invalidate()
+    download_cache.invalidate()
     return redirect(request.referrer)
 
 
@@ -271,8 +336,17 @@ def delete_package(identifier):
     package = Package.query.filter_by(identifier=identifier).first()
     if package is None:
         return "Package not found", 404
+    sha256s = [
+        installer.installer_sha256
+        for version in package.versions
+        for installer in version.installers
+        if is_stored(installer)
+    ]
     db.session.delete(package)
     db.session.commit()
+    manifest_cache.invalidate()
+    download_cache.invalidate()
+    blob_store.release(sha256s)
     return "", 204
 
 
@@ -316,8 +390,11 @@ def add_version(identifier):
         version.installers.append(installer)
 
     package.versions.append(version)
+    package.touch()
     try:
         db.session.commit()
+        manifest_cache.invalidate()
+        download_cache.invalidate()
         current_app.logger.info(
             f"Version {version.version_code} added successfully to package {package.identifier}"
         )
@@ -361,11 +438,98 @@ def add_installer(identifier):
             return "Error creating installer", 500
 
         version.installers.append(installer)
+        package.touch()
         db.session.commit()
+        manifest_cache.invalidate()
+        download_cache.invalidate()
 
         return redirect(request.referrer)
 
 
+@api.route("/package/<identifier>/negotiate_installer", methods=["POST"])
+@login_required
+@permission_required("add:installer")
+def negotiate_installer(identifier):
+    """Add an installer to a version without uploading it again if a file with its SHA256 is already stored.
+
+    The client sends the installer fields of add_installer along with the
+    sha256, size and file_name of the file. If the file is stored, the installer
+    is added and returned with status 201. Otherwise the response tells where
+    to upload it: PUT it to the presigned S3 URL and then call add_installer
+    with is_aws, or POST it to add_installer.
+    """
+    form = NegotiateInstallerForm(meta={"csrf": False})
+    installer_form = form.installer
+
+    if not form.validate_on_submit():
+        validation_errors = form.errors
+        current_app.logger.warning(f"Validation errors: {validation_errors}")
+        return jsonify(validation_errors), 400
+    # The installer fields are only required along with a file or URL, there's neither here
+    if not installer_form.version.data:
+        return jsonify({"installer": {"version": ["This field is required."]}}), 400
+
+    package = Package.query.filter_by(identifier=identifier).first()
+    if package is None:
+        return "Package not found", 404
+
+    version = PackageVersion.query.filter_by(
+        identifier=identifier, version_code=installer_form.version.data
+    ).first()
+    if version is None:
+        return "Package version not found", 404
+
+    sha256 = form.sha256.data.lower()
+    scope = installer_form.installer_scope.data
+    file_name = f"{scope}." + secure_filename(form.file_name.data).rsplit(".", 1)[1]
+    # Held until the installer is committed, so the blob can't be released in between
+    blob_store.lock(sha256)
+    size = blob_store.size(sha256)
+
+    if size is None:
+        add_installer_url = url_for("api.add_installer", identifier=identifier, _external=True)
+        if not get_setting("USE_S3"):
+            return jsonify({"status": "upload", "method": "POST", "upload_url": add_installer_url})
+        s3_object_key = s3_upload_key(
+            package.publisher, identifier, version.version_code, installer_form.architecture.data, file_name
+        )
+        presigned_url = s3_client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": get_setting("BUCKET_NAME"),
+                "Key": s3_object_key,
+                "ContentType": "application/octet-stream",
+            },
+            ExpiresIn=URL_EXPIRATION_SECONDS,
+        )
+        return jsonify(
+            {
+                "status": "upload",
+                "method": "PUT",
+                "upload_url": presigned_url,
+                "file_path": s3_object_key,
+                "complete_url": add_installer_url,
+            }
+        )
+
+    if size != form.size.data:
+        current_app.logger.warning(f"Size of {sha256} doesn't match: declared {form.size.data}, stored {size}")
+        return "Size doesn't match the stored file with this SHA256", 409
+
+    installer = build_installer(installer_form, file_name, None, sha256)
+    if not isinstance(installer, Installer):
+        return installer
+
+    version.installers.append(installer)
+    package.touch()
+    db.session.commit()
+    manifest_cache.invalidate()
+    download_cache.invalidate()
+    current_app.logger.info(f"Installer {sha256} linked to {identifier} {version.version_code} without upload")
+
+    return jsonify(installer.to_dict()), 201
+
+
 @api.route("/package/<identifier>/edit_installer", methods=["POST"])
 @login_required
 @permission_required("edit:installer")
@@ -378,6 +542,15 @@ def edit_installer(identifier):
 
     current_app.logger.info(f"Installer found: {installer}")
 
+    # Lets installers added before these fields existed be matched by winget upgrade
+    for field_name in ("product_code", "package_family_name"):
+        if field_name in request.form:
+            field_value = request.form[field_name].strip()
+            if len(field_value) > 255:
+                return f"{field_name} can't be longer than 255 characters", 400
+            setattr(installer, field_name, field_value or None)
+
+    installer.package_version.package.touch()
     current_app.logger.info("Going through installer switches to update them")
     for field_name in installer_switches:
         current_app.logger.info(f"Field name: {field_name}")
@@ -404,6 +577,7 @@ def edit_installer(identifier):
 
         db.session.commit()
 
+    manifest_cache.invalidate()
     return redirect(request.referrer)
 
 
@@ -428,10 +602,13 @@ def delete_installer(identifier, version, installer):
         current_app.logger.warning("Installer not found")
         return "Installer not found", 404
 
-    delete_installer_util(package, installer, version)
-
+    sha256s = [installer.installer_sha256] if is_stored(installer) else []
     db.session.delete(installer)
+    package.touch()
     db.session.commit()
+    manifest_cache.invalidate()
+    download_cache.invalidate()
+    blob_store.release(sha256s)
 
     return "", 200
 
@@ -452,11 +629,14 @@ def delete_version(identifier, version):
         current_app.logger.warning("Version not found")
         return "Version not found", 404
 
-    for installer in version.installers:
-        delete_installer_util(package, installer, version)
+    sha256s = [installer.installer_sha256 for installer in version.installers if is_stored(installer)]
     db.session.delete(version)
+    package.touch()
     try:
         db.session.commit()
+        manifest_cache.invalidate()
+        download_cache.invalidate()
+        blob_store.release(sha256s)
         current_app.logger.info(
             f"Version {version.version_code} successfully removed from package {package.identifier}"
         )
@@ -594,6 +774,7 @@ def update_setting():
     # Update the setting's value
     setting.set_value(value)
     db.session.commit()
+    settings_cache.invalidate()
 
     return jsonify(setting.to_dict())
 
@@ -679,105 +860,118 @@ def delete_user(id):
     return "", 200
 
 
+DownloadLocation = namedtuple(
+    "DownloadLocation",
+    [
+        "package_id",
+        "version_id",
+        "installer_id",
+        "architecture",
+        "file_name",
+        "external_url",
+        "installer_sha256",
+    ],
+)
+
+
+def resolve_download(identifier, version, architecture, scope):
+    """Look up where the installer for a download URL is stored, None if there is no such installer."""
+    key = (identifier, version, architecture, scope)
+    location = download_cache.get(key)
+    if location is not None:
+        return location
+
+    row = (
+        db.session.query(
+            Package.id,
+            PackageVersion.id.label("version_id"),
+            Installer.id.label("installer_id"),
+            Installer.file_name,
+            Installer.external_url,
+            Installer.installer_sha256,
+        )
+        .join(PackageVersion, PackageVersion.identifier == Package.identifier)
+        .join(Installer, Installer.version_id == PackageVersion.id)
+        .filter(
+            Package.identifier == identifier,
+            PackageVersion.version_code == version,
+            Installer.architecture == architecture,
+            Installer.scope == scope,
+        )
+        .first()
+    )
+    if row is None:
+        return None
+    location = DownloadLocation(
+        package_id=row.id,
+        version_id=row.version_id,
+        installer_id=row.installer_id,
+        architecture=architecture,
+        file_name=row.file_name,
+        external_url=row.external_url,
+        installer_sha256=row.installer_sha256,
+    )
+    download_cache.set(key, location)
+    return location
+
+
+def offload_download(location, mode):
+    """Let the reverse proxy send the file, it reads the path from X-Accel-Redirect (nginx) or X-Sendfile."""
+    response = Response(mimetype="application/octet-stream")
+    response.headers["Content-Disposition"] = f"attachment; filename={location.file_name}"
+    if mode == "x-sendfile":
+        response.headers["X-Sendfile"] = blob_store.path(location.installer_sha256)
+    else:
+        prefix = get_config("DOWNLOAD_OFFLOAD_PREFIX", "/internal-packages/")
+        response.headers["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(blob_store.key(location.installer_sha256))
+    return response
+
+
 @api.route("/download/<identifier>/<version>/<architecture>/<scope>")
 def download(identifier, version, architecture, scope):
-    # TODO: Improve this function to be more efficient, also when a package's publisher is renamed the file won't be found anymore
-    package = Package.query.filter_by(identifier=identifier).first()
-    if package is None:
-        current_app.logger.warning("Package not found")
-        return "Package not found", 404
-
-    # Get version of package and also match package
-    version_code = PackageVersion.query.filter_by(
-        version_code=version, identifier=identifier
-    ).first()
-    if version_code is None:
-        current_app.logger.warning("Version not found")
-        return "Package version not found", 404
-    # Get installer of package version and also match architecture and identifier
-    installer = Installer.query.filter_by(
-        version_id=version_code.id, architecture=architecture, scope=scope
-    ).first()
-    if installer is None:
-        current_app.logger.warning("Installer not found")
+    location = resolve_download(identifier, version, architecture, scope)
+    if location is None:
+        current_app.logger.warning(f"Installer not found: {identifier} {version} {architecture} {scope}")
         return "Installer not found", 404
 
-    if Setting.get("USE_S3").get_value() and installer.external_url is None:
-        current_app.logger.info("Downloading from S3")
+    if get_setting("USE_S3") and location.external_url is None:
         # Generate a pre-signed URL for the S3 object
-        presigned_url = s3_client.generate_presigned_url(
-            "get_object",
-            Params={
-                "Bucket": Setting.get("BUCKET_NAME").get_value(),
-                "Key": "packages/"
-                + package.publisher
-                + "/"
-                + package.identifier
-                + "/"
-                + version_code.version_code
-                + "/"
-                + installer.architecture
-                + "/"
-                + installer.file_name,
-                "ResponseContentDisposition": "attachment; filename="
-                + installer.file_name,
-                "ResponseContentType": "application/octet-stream",
-            },
-            ExpiresIn=URL_EXPIRATION_SECONDS,
+        presigned_url = presigned_urls.get_object_url(
+            get_setting("BUCKET_NAME"),
+            blob_store.key(location.installer_sha256),
+            ResponseContentDisposition="attachment; filename=" + location.file_name,
+            ResponseContentType="application/octet-stream",
         )
 
-        # Increment the download count and commit to the database
-        package.download_count += 1
-        db.session.commit()
+        download_counter.add(
+            location.package_id, location.version_id, location.installer_id, location.architecture
+        )
 
         # Redirect the client to the pre-signed URL
         return redirect(presigned_url)
 
     # If the installer has an external URL, redirect the client to it
-    if installer.external_url:
-        current_app.logger.info("Downloading from external URL")
-        # Increment the download count and commit to the database
-        package.download_count += 1
-        db.session.commit()
+    if location.external_url:
+        download_counter.add(
+            location.package_id, location.version_id, location.installer_id, location.architecture
+        )
 
-        # Redirect the client to the pre-signed URL
-        return redirect(installer.external_url)
-
-    installer_path = os.path.join(
-        basedir,
-        "packages",
-        package.publisher,
-        package.identifier,
-        version_code.version_code,
-        installer.architecture,
-    )
+        # Serve it from the pull-through cache if enabled, otherwise redirect the client to it
+        response = installer_cache.serve(location.external_url, location.installer_sha256)
+        if response is not None:
+            return response
+        return redirect(location.external_url)
 
-    current_app.logger.info("Starting download for package:")
-    current_app.logger.info(f"Package name: {package.name}")
-    current_app.logger.info(f"Package identifier: {package.identifier}")
-    current_app.logger.info(f"Package version: {version_code.version_code}")
-    current_app.logger.info(f"Architecture: {installer.architecture}")
-    current_app.logger.info(f"Installer file name: {installer.file_name}")
-    current_app.logger.info(f"Installer SHA256: {installer.installer_sha256}")
-    current_app.logger.info(
-        f"Installer path: {installer_path + '/' + installer.file_name}"
-    )
-    if installer.external_url:
-        current_app.logger.info(f"External URL: {installer.external_url}")
-
-    # Check if the Range header is present
-    range_header = request.headers.get("Range")
-
-    is_partial = range_header is not None
-    if is_partial:
-        request.range = parse_range_header(range_header)
-        if request.range is None:
-            current_app.logger.warning("Invalid range header")
-            return "Invalid range header", 400
-
-    # Only add to download_count for a whole file download not part of it (winget uses range)
-    if (is_partial and range_header and range_header == "bytes=0-1") or not is_partial:
-        package.download_count += 1
-        db.session.commit()
+    current_app.logger.debug(f"Downloading {location.installer_sha256} as {location.file_name}")
+
+    # Count whole downloads and the first part of ranged ones, not every resumed part (winget uses range)
+    if request.range is None or request.range.ranges[0][0] == 0:
+        download_counter.add(
+            location.package_id, location.version_id, location.installer_id, location.architecture
+        )
+
+    offload = get_config("DOWNLOAD_OFFLOAD")
+    if offload:
+        return offload_download(location, offload)
 
-    return send_from_directory(installer_path, installer.file_name, as_attachment=True)
+    return send_installer(blob_store.path(location.installer_sha256), location.file_name, location.installer_sha256)
@@ -0,0 +1,138 @@
+import os
+
+from botocore.exceptions import ClientError
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Blob, Installer
+from app.s3 import s3_client
+from app.settings import get_setting
+
+PACKAGES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "packages")
+
+
+def is_stored(installer):
+    """Whether the installer's file is kept by WinGetty rather than downloaded from an external URL."""
+    return installer.external_url is None and installer.file_name is not None
+
+
+class BlobStore:
+    """Installer files stored once per content, keyed by their SHA256.
+
+    Locally a file lives at packages/blobs/<first two characters>/<sha256>,
+    on S3 under the same key. Any number of installers can point to one blob,
+    so publishing the same file for several versions, scopes or architectures
+    stores it once, and renaming a package doesn't move anything. A blob is
+    referenced by every installer of a version with its SHA256 that isn't an
+    external URL, it's removed when the last of them is deleted.
+
+    Adding an installer for a blob and removing the blob both hold the blob's
+    lock, so a file can't be removed while an installer is being linked to it.
+    """
+
+    def __init__(self, directory=PACKAGES_DIR):
+        self.directory = directory
+
+    @staticmethod
+    def key(sha256):
+        sha256 = sha256.lower()
+        return f"blobs/{sha256[:2]}/{sha256}"
+
+    def path(self, sha256):
+        return os.path.join(self.directory, *self.key(sha256).split("/"))
+
+    def lock(self, sha256):
+        """Lock the blob until the transaction is committed or rolled back."""
+        sha256 = sha256.lower()
+        # Updating the row holds a lock on it until commit, like download_stats._lock_compaction
+        updated = db.session.execute(
+            db.update(Blob).where(Blob.sha256 == sha256).values(sha256=Blob.sha256)
+        ).rowcount
+        if updated:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(Blob(sha256=sha256))
+        except IntegrityError:
+            # Another worker created the row at the same time, wait for it to commit
+            self.lock(sha256)
+
+    def references(self, sha256):
+        """Number of installers that use the blob."""
+        return (
+            db.session.query(func.count(Installer.id))
+            .filter(
+                Installer.installer_sha256 == sha256,
+                Installer.version_id.isnot(None),
+                Installer.external_url.is_(None),
+                Installer.file_name.isnot(None),
+            )
+            .scalar()
+        )
+
+    def size(self, sha256):
+        """Size of the stored blob in bytes, None if it isn't stored."""
+        if get_setting("USE_S3"):
+            try:
+                return s3_client.head_object(Bucket=get_setting("BUCKET_NAME"), Key=self.key(sha256))["ContentLength"]
+            except ClientError:
+                return None
+        try:
+            return os.path.getsize(self.path(sha256))
+        except FileNotFoundError:
+            return None
+
+    def add_file(self, path, sha256):
+        """Move the file at path into the store, it's dropped if the blob is already stored.
+
+        Locks the blob, commit the installer that uses it in the same transaction.
+        """
+        self.lock(sha256)
+        if get_setting("USE_S3"):
+            key = self.key(sha256)
+            if not self.references(sha256):
+                current_app.logger.info(f"Uploading blob to S3: {key}")
+                s3_client.upload_file(path, get_setting("BUCKET_NAME"), key)
+            os.remove(path)
+            return
+
+        target = self.path(sha256)
+        if os.path.exists(target):
+            os.remove(path)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def add_s3_object(self, key, sha256):
+        """Move an object that was uploaded straight to S3 into the store, locks the blob like add_file."""
+        self.lock(sha256)
+        bucket = get_setting("BUCKET_NAME")
+        if not self.references(sha256):
+            s3_client.copy({"Bucket": bucket, "Key": key}, bucket, self.key(sha256))
+        s3_client.delete_object(Bucket=bucket, Key=key)
+
+    def release(self, sha256s):
+        """Remove the blobs no installer uses anymore, call after deleting installers is committed."""
+        for sha256 in set(sha256s):
+            if not sha256:
+                continue
+            self.lock(sha256)
+            if self.references(sha256):
+                db.session.commit()
+                continue
+            if get_setting("USE_S3"):
+                current_app.logger.info(f"Deleting blob from S3: {self.key(sha256)}")
+                s3_client.delete_object(Bucket=get_setting("BUCKET_NAME"), Key=self.key(sha256))
+            else:
+                try:
+                    os.remove(self.path(sha256))
+                    current_app.logger.info(f"Deleted blob {sha256}")
+                except FileNotFoundError:
+                    pass
+            db.session.execute(db.delete(Blob).where(Blob.sha256 == sha256.lower()))
+            db.session.commit()
+
+
+blob_store = BlobStore()
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import CacheGeneration
+
+
+class SharedLRUCache:
+    """A bounded per-worker LRU cache that can be invalidated across all workers.
+
+    Every cache is tied to a generation counter in the `cache_generation` table.
+    Invalidating a cache bumps that counter, other workers notice the new value
+    the next time they look at it and drop their local entries. The counter is
+    only read once every `CACHE_CHECK_INTERVAL` seconds so hits in between
+    don't touch the database at all.
+    """
+
+    def __init__(self, name, maxsize=512):
+        self.name = name
+        self.maxsize = maxsize
+        self.check_interval = 5
+        self.generation = None
+        self._checked_at = 0.0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app, size_key=None):
+        # Read once, looking up app.config on every hit costs more than the hit itself
+        self.check_interval = float(app.config.get("CACHE_CHECK_INTERVAL", self.check_interval))
+        if size_key:
+            self.maxsize = int(app.config.get(size_key, self.maxsize))
+
+    def get(self, key, default=None):
+        self._sync()
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def invalidate(self):
+        """Drop this cache on the current worker and bump the shared generation for all others."""
+        try:
+            self.generation = self._bump_generation()
+        except IntegrityError:
+            # Another worker created the row at the same time, it'll exist now
+            db.session.rollback()
+            self.generation = self._bump_generation()
+        self.clear()
+        self._checked_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _sync(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        generation = (
+            db.session.query(CacheGeneration.value).filter_by(name=self.name).scalar()
+            or 0
+        )
+        if generation != self.generation:
+            if self.generation is not None:
+                current_app.logger.debug(f"Cache {self.name} is stale, clearing")
+            self.clear()
+            self.generation = generation
+
+    def _bump_generation(self):
+        updated = db.session.execute(
+            db.update(CacheGeneration)
+            .where(CacheGeneration.name == self.name)
+            .values(value=CacheGeneration.value + 1)
+        ).rowcount
+        if not updated:
+            db.session.add(CacheGeneration(name=self.name, value=1))
+        db.session.commit()
+        return db.session.query(CacheGeneration.value).filter_by(name=self.name).scalar()
+
+
+manifest_cache = SharedLRUCache("manifests")
+# Resolved storage location of each installer download URL
+download_cache = SharedLRUCache("downloads", maxsize=4096)
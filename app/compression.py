@@ -0,0 +1,104 @@
+import gzip
+import threading
+
+from flask import current_app, request
+
+from app.settings import get_config
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def available_encodings():
+    """Content codings we can produce, in order of preference."""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def negotiate_encoding(size):
+    """Pick the content coding for a body of size bytes based on the request's Accept-Encoding.
+
+    Returns None when the body should be sent as is.
+    """
+    if size < get_config("COMPRESSION_MIN_SIZE", 1024):
+        return None
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def etag_for_encoding(etag, encoding):
+    # Compressed bodies are different representations so they need their own strong ETag
+    return f"{etag}-{encoding}" if encoding else etag
+
+
+def matching_etag(etag):
+    """Return the variant of etag the client sent in If-None-Match, or None if it didn't send any."""
+    for encoding in [None] + available_encodings():
+        variant = etag_for_encoding(etag, encoding)
+        if request.if_none_match.contains(variant):
+            return variant
+    return None
+
+
+class PrecompressedBody:
+    """A rendered response body that keeps its compressed variants around.
+
+    Every variant is compressed the first time a client asks for it and reused
+    until the body itself is replaced.
+    """
+
+    def __init__(self, body, etag):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.etag = etag
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        if encoding is None:
+            return self.body
+        data = self._encoded.get(encoding)
+        if data is None:
+            with self._lock:
+                data = self._encoded.get(encoding)
+                if data is None:
+                    data = self._encoded[encoding] = compress(self.body, encoding)
+        return data
+
+    def make_response(self, mimetype="application/json"):
+        encoding = negotiate_encoding(len(self.body))
+        response = current_app.response_class(self.encoded(encoding), mimetype=mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        response.set_etag(etag_for_encoding(self.etag, encoding))
+        return response
+
+
+def compress_response(response):
+    """Compress a finished JSON response on the fly, for responses that aren't cached."""
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype != "application/json"
+    ):
+        return response
+    data = response.get_data()
+    encoding = negotiate_encoding(len(data))
+    response.vary.add("Accept-Encoding")
+    if encoding:
+        etag, _ = response.get_etag()
+        response.set_data(compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        if etag:
+            response.set_etag(etag_for_encoding(etag, encoding))
+    return response
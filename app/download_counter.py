@@ -0,0 +1,106 @@
+import atexit
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.download_stats import compact, record, truncate
+from app.models import Installer, Package, PackageVersion
+
+
+class DownloadCounter:
+    """Counts downloads in memory and adds them to the database in batches.
+
+    A download only bumps a counter of the worker that served it. A background
+    thread flushes the counts every DOWNLOAD_FLUSH_INTERVAL seconds with one
+    `UPDATE ... SET download_count = download_count + n` statement per table,
+    so downloads never wait on the database. The same transaction appends the
+    per-minute download stats. Pending counts are flushed again when the worker
+    shuts down.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.interval = 10
+        self.compact_interval = 600
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._thread_pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = float(app.config.get("DOWNLOAD_FLUSH_INTERVAL", self.interval))
+        self.compact_interval = float(app.config.get("DOWNLOAD_STATS_COMPACT_INTERVAL", self.compact_interval))
+        atexit.register(self.flush)
+
+    def add(self, package_id, version_id, installer_id, architecture):
+        minute = truncate(datetime.utcnow(), "minute")
+        with self._lock:
+            self._pending[(minute, package_id, version_id, installer_id, architecture)] += 1
+        self._start()
+
+    def flush(self):
+        """Write the pending counts to the database, they are kept for the next flush if that fails."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return
+
+        totals = {Package: Counter(), PackageVersion: Counter(), Installer: Counter()}
+        for (_, package_id, version_id, installer_id, _), count in pending.items():
+            totals[Package][package_id] += count
+            totals[PackageVersion][version_id] += count
+            totals[Installer][installer_id] += count
+
+        with self.app.app_context():
+            try:
+                for model, counts in totals.items():
+                    table = model.__table__
+                    db.session.execute(
+                        update(table)
+                        .where(table.c.id == bindparam("row_id"))
+                        .values(download_count=func.coalesce(table.c.download_count, 0) + bindparam("count")),
+                        [{"row_id": row_id, "count": count} for row_id, count in counts.items()],
+                    )
+                record(pending)
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                with self._lock:
+                    self._pending.update(pending)
+                self.app.logger.error(f"Failed to save download counts, retrying later: {e}")
+
+    def _start(self):
+        # Started on first use so every forked worker gets its own thread
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name="download-counter", daemon=True).start()
+
+    def compact(self):
+        with self.app.app_context():
+            try:
+                compact()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                self.app.logger.error(f"Failed to compact download stats: {e}")
+
+    def _run(self):
+        compacted_at = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+            if time.monotonic() - compacted_at >= self.compact_interval:
+                self.compact()
+                compacted_at = time.monotonic()
+
+
+download_counter = DownloadCounter()
@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import DateTime, cast, func, insert, literal, select, type_coerce
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import CacheGeneration, DownloadStat
+
+PERIODS = ["minute", "hour", "day"]
+
+PERIOD_LENGTHS = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+# strftime formats that truncate a timestamp to the start of its bucket, in the
+# format SQLAlchemy stores datetimes in on SQLite
+SQLITE_FORMATS = {"minute": "%Y-%m-%d %H:%M:00.000000", "hour": "%Y-%m-%d %H:00:00.000000", "day": "%Y-%m-%d 00:00:00.000000"}
+MYSQL_FORMATS = {"minute": "%Y-%m-%d %H:%i:00", "hour": "%Y-%m-%d %H:00:00", "day": "%Y-%m-%d 00:00:00"}
+
+
+def truncate(moment, period):
+    """Start of the bucket of the given period that moment falls into."""
+    if period == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if period == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def truncate_column(column, period):
+    """SQL expression for the start of the bucket of the given period the column falls into."""
+    dialect = db.session.get_bind().dialect.name
+    # Rendered inline, the expression has to be the same in the select and the group by
+    if dialect == "postgresql":
+        return func.date_trunc(literal(period, literal_execute=True), column)
+    if dialect == "mysql":
+        return cast(func.date_format(column, literal(MYSQL_FORMATS[period], literal_execute=True)), DateTime)
+    return type_coerce(func.strftime(literal(SQLITE_FORMATS[period], literal_execute=True), column), DateTime)
+
+
+def record(counts):
+    """Append per-minute rows for counts, a Counter of
+    (minute, package_id, version_id, installer_id, architecture) keys.
+    Doesn't commit so it's saved together with the download counters."""
+    if not counts:
+        return
+    db.session.execute(
+        insert(DownloadStat),
+        [
+            {
+                "period": "minute",
+                "bucket": minute,
+                "package_id": package_id,
+                "version_id": version_id,
+                "installer_id": installer_id,
+                "architecture": architecture,
+                "count": count,
+            }
+            for (minute, package_id, version_id, installer_id, architecture), count in counts.items()
+        ],
+    )
+
+
+def _lock_compaction():
+    # Updating the row holds a lock on it until commit, so workers take turns compacting
+    updated = db.session.execute(
+        db.update(CacheGeneration)
+        .where(CacheGeneration.name == "download_stats")
+        .values(value=CacheGeneration.value + 1)
+    ).rowcount
+    if not updated:
+        db.session.add(CacheGeneration(name="download_stats", value=1))
+        db.session.flush()
+
+
+def _roll_up(source, target, cutoff):
+    """Roll the source rows of the oldest target bucket before cutoff up into the target period.
+
+    Summed and deleted in the database, one target bucket at a time so a
+    backlog doesn't end up in one huge transaction. Returns the number of
+    source rows that were rolled up, 0 when there are none left.
+    """
+    start = (
+        db.session.query(func.min(DownloadStat.bucket))
+        .filter(DownloadStat.period == source, DownloadStat.bucket < cutoff)
+        .scalar()
+    )
+    if start is None:
+        return 0
+    start = truncate(start, target)
+    end = min(start + PERIOD_LENGTHS[target], cutoff)
+    in_window = (DownloadStat.period == source, DownloadStat.bucket >= start, DownloadStat.bucket < end)
+    bucket = truncate_column(DownloadStat.bucket, target)
+    keys = (DownloadStat.package_id, DownloadStat.version_id, DownloadStat.installer_id, DownloadStat.architecture)
+    db.session.execute(
+        insert(DownloadStat).from_select(
+            ["period", "bucket", "package_id", "version_id", "installer_id", "architecture", "count"],
+            select(literal(target), bucket, *keys, func.sum(DownloadStat.count))
+            .where(*in_window)
+            .group_by(bucket, *keys),
+        )
+    )
+    return db.session.execute(db.delete(DownloadStat).where(*in_window)).rowcount
+
+
+def compact(now=None):
+    """Roll minute rows up into hours and hour rows up into days once they're older
+    than DOWNLOAD_STATS_MINUTE_RETENTION and DOWNLOAD_STATS_HOUR_RETENTION."""
+    now = now or datetime.utcnow()
+    config = current_app.config
+    minute_cutoff = truncate(now - timedelta(hours=config.get("DOWNLOAD_STATS_MINUTE_RETENTION", 24)), "hour")
+    hour_cutoff = truncate(now - timedelta(days=config.get("DOWNLOAD_STATS_HOUR_RETENTION", 30)), "day")
+    rolled_up = 0
+    for source, target, cutoff in (("minute", "hour", minute_cutoff), ("hour", "day", hour_cutoff)):
+        while True:
+            try:
+                _lock_compaction()
+            except IntegrityError:
+                # Another worker created the row at the same time, it'll exist now
+                db.session.rollback()
+                _lock_compaction()
+            rows = _roll_up(source, target, cutoff)
+            db.session.commit()
+            if not rows:
+                break
+            rolled_up += rows
+    return rolled_up
+
+
+def download_trend(package_id, period="hour", since=None, until=None, version_ids=None, architecture=None, group_by=None):
+    """Downloads of a package per bucket of period, oldest first.
+
+    Returns a dict of series keyed by the group_by column ("version_id" or
+    "architecture"), or a single series keyed by None. Rows that were already
+    rolled up into a coarser period count towards the start of their bucket.
+    """
+    bucket = truncate_column(DownloadStat.bucket, period)
+    keys = [getattr(DownloadStat, group_by)] if group_by else []
+    query = db.session.query(*keys, bucket, func.sum(DownloadStat.count)).filter(DownloadStat.package_id == package_id)
+    if since is not None:
+        query = query.filter(DownloadStat.bucket >= since)
+    if until is not None:
+        query = query.filter(DownloadStat.bucket < until)
+    if version_ids is not None:
+        query = query.filter(DownloadStat.version_id.in_(version_ids))
+    if architecture is not None:
+        query = query.filter(DownloadStat.architecture == architecture)
+
+    series = {}
+    for row in query.group_by(*keys, bucket).order_by(bucket):
+        series.setdefault(row[0] if group_by else None, []).append((row[-2], row[-1]))
+    return series
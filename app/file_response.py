@@ -0,0 +1,153 @@
+import io
+import os
+import secrets
+from datetime import datetime, timezone
+
+from flask import abort, current_app, request
+from werkzeug.wsgi import wrap_file
+
+BUFFER_SIZE = 1024 * 1024
+
+
+class FileRange:
+    """File-like object that reads at most length bytes of file starting at offset.
+
+    Handed to the server's wsgi.file_wrapper so it can use sendfile. Servers
+    like gunicorn call os.sendfile from the start of the file no matter where
+    it is positioned, so the descriptor is only exposed when the range starts
+    at 0. Other ranges are read in large blocks instead.
+    """
+
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.remaining = length
+        self._offset = offset
+        file.seek(offset)
+
+    def fileno(self):
+        if self._offset:
+            raise io.UnsupportedOperation("fileno")
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def resolve_ranges(ranges, size):
+    """Turn the ranges of a Range header into (start, stop) pairs within size, dropping unsatisfiable ones."""
+    resolved = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            resolved.append((start, stop))
+    return resolved
+
+
+def multipart_body(file, spans, size, boundary):
+    """Yield a multipart/byteranges body, along with its length as the first item."""
+    try:
+        headers = [
+            (
+                f"--{boundary}\r\nContent-Type: application/octet-stream\r\n"
+                f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+            ).encode()
+            for start, stop in spans
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode()
+        yield (
+            sum(len(header) for header in headers)
+            + sum(stop - start for start, stop in spans)
+            + 2 * (len(spans) - 1)
+            + len(closing)
+        )
+
+        for index, ((start, stop), header) in enumerate(zip(spans, headers)):
+            if index:
+                yield b"\r\n"
+            yield header
+            file.seek(start)
+            remaining = stop - start
+            while remaining:
+                data = file.read(min(BUFFER_SIZE, remaining))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+        yield closing
+    finally:
+        file.close()
+
+
+def send_installer(path, download_name, sha256=None):
+    """Send an installer with conditional and (multi-)range request support.
+
+    The ETag is the installer's SHA256, so it stays the same on every worker and
+    after the file is copied. Whole files and single ranges go through
+    wsgi.file_wrapper so the server can use sendfile.
+    """
+    try:
+        file = open(path, "rb")
+    except (FileNotFoundError, IsADirectoryError):
+        abort(404)
+    stat = os.fstat(file.fileno())
+    size = stat.st_size
+    modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    etag = (sha256 or "").lower() or f"{int(stat.st_mtime)}-{size}"
+
+    response = current_app.response_class(mimetype="application/octet-stream", direct_passthrough=True)
+    response.set_etag(etag)
+    response.last_modified = modified
+    response.headers["Accept-Ranges"] = "bytes"
+    response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = request.if_modified_since is not None and request.if_modified_since >= modified
+    if not_modified:
+        file.close()
+        response.status_code = 304
+        return response
+
+    spans = None
+    if request.range is not None and request.range.units == "bytes":
+        # A range only applies to the representation the client already has part of
+        if_range = request.if_range
+        if (
+            "If-Range" not in request.headers
+            or if_range.etag == etag
+            or (if_range.date is not None and if_range.date >= modified)
+        ):
+            spans = resolve_ranges(request.range.ranges, size)
+            if not spans:
+                file.close()
+                response.status_code = 416
+                response.headers["Content-Range"] = f"bytes */{size}"
+                return response
+
+    if spans is not None and len(spans) > 1:
+        boundary = secrets.token_hex(16)
+        body = multipart_body(file, spans, size, boundary)
+        response.status_code = 206
+        response.content_length = next(body)
+        response.content_type = f"multipart/byteranges; boundary={boundary}"
+        response.response = body
+        return response
+
+    start, stop = spans[0] if spans else (0, size)
+    if spans:
+        response.status_code = 206
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    response.content_length = stop - start
+    response.response = wrap_file(request.environ, FileRange(file, start, stop - start), BUFFER_SIZE)
+    return response
@@ -1,13 +1,15 @@
+import re
+
 from flask import current_app
 from flask_wtf import FlaskForm
 from wtforms import (StringField, TextAreaField, IntegerField, BooleanField,
                      RadioField, FileField, SelectField)
-from wtforms.validators import InputRequired, Length, Optional    
+from wtforms.validators import InputRequired, Length, NumberRange, Optional, Regexp
 from flask_wtf.file import FileField, FileAllowed, FileRequired
 import wtforms
 from wtforms import Form, StringField, SelectField, validators, ValidationError
 
-from app.models import Setting
+from app.settings import get_setting
 from . import constants
 class RequiredIf(object):
 
@@ -79,7 +81,7 @@ class AddInstallerFormFields(FlaskForm):
             self.file.validators.append(Optional())
             self.url.validators.append(Optional())  # Both fields are optional when file_required is False
 
-        if Setting.get("USE_S3").get_value() and file_required:
+        if get_setting("USE_S3") and file_required:
             self.is_aws.validators.append(InputRequired())
 
 
@@ -108,6 +110,10 @@ class AddInstallerFormFields(FlaskForm):
     nestedinstallerpath = StringField('Nested Installer Path', validators=[
         RequiredIf(installer_type='zip')
         ])
+
+    product_code = StringField('Product Code', validators=[Optional(), Length(max=255)])
+
+    package_family_name = StringField('Package Family Name', validators=[Optional(), Length(max=255)])
     
 class AddInstallerFormFieldsWithoutFile(AddInstallerFormFields):
     def __init__(self, *args, **kwargs):
@@ -129,6 +135,11 @@ class AddPackageForm(FlaskForm):
     Length(min=1, max=101)
     ])
 
+    moniker = StringField('Moniker', validators=[Optional(), Length(max=100)])
+
+    # Comma separated
+    tags = StringField('Tags', validators=[Optional()])
+
     # Include the AddInstallerFormFields without csrf protection
     installer = wtforms.FormField(AddInstallerFormFieldsWithoutFile)
 
@@ -143,6 +154,15 @@ class AddVersionForm(FlaskForm):
     installer = wtforms.FormField(AddInstallerFormFieldsWithoutFile)
 
 
+class NegotiateInstallerForm(FlaskForm):
+    # The installer is described by its hash and size, the file itself is only sent when it isn't stored yet
+    sha256 = StringField('SHA256', validators=[InputRequired(), Regexp(r'^[0-9a-fA-F]{64}$')])
 
+    size = IntegerField('Size', validators=[InputRequired(), NumberRange(min=1)])
 
+    file_name = StringField('File name', validators=[
+    InputRequired(),
+    Regexp(r'.+\.(exe|zip|msi|msix|appx)$', flags=re.IGNORECASE, message='File type not allowed.')
+    ])
 
+    installer = wtforms.FormField(AddInstallerFormFieldsWithoutFile)
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from flask import current_app, request
+
+from app.file_response import send_installer
+
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+PART_SUFFIX = ".part"
+CHUNK_SIZE = 1024 * 1024
+# A partial download this old belongs to a worker that died, it's taken over by the next request
+STALE_PART_SECONDS = 3600
+
+
+class InstallerCache:
+    """Pull-through cache on local disk for installers that have an external URL.
+
+    The first download of an installer is streamed from the external URL to the
+    client and to disk at the same time. The file is only kept when its SHA256
+    matches the installer's, later downloads are served from disk with range
+    support. Files are named by their SHA256 and the least recently downloaded
+    ones are removed once the cache grows past INSTALLER_CACHE_MAX_SIZE bytes.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.max_size = 0
+        self.session = requests.Session()
+
+    def init_app(self, app):
+        self.directory = app.config.get("INSTALLER_CACHE_DIR") or None
+        self.max_size = int(app.config.get("INSTALLER_CACHE_MAX_SIZE", 10 * 1024 ** 3))
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def serve(self, url, sha256):
+        """Return a response for the installer at url, or None if the client should be redirected to it."""
+        sha256 = (sha256 or "").lower()
+        if not self.enabled or not SHA256_PATTERN.fullmatch(sha256):
+            return None
+        download_name = os.path.basename(urlparse(url).path) or sha256
+        path = self._path(sha256)
+        if os.path.exists(path):
+            # The modification time is the last use for eviction
+            os.utime(path)
+            return send_installer(path, download_name, sha256)
+
+        part = self._claim(sha256)
+        if part is None:
+            # Another request is already filling the cache
+            return None
+        logger = current_app.logger
+        timeout = current_app.config.get("INSTALLER_CACHE_TIMEOUT", 30)
+        if request.range is not None:
+            # Can't cache from a partial response, fetch the whole file on the side
+            threading.Thread(
+                target=self._fill, args=(url, sha256, part, timeout, logger), name="installer-cache-fill", daemon=True
+            ).start()
+            return None
+
+        upstream = self._open(url, sha256, part, timeout, logger)
+        if upstream is None:
+            return None
+        response = current_app.response_class(
+            self._copy(upstream, url, sha256, part, logger),
+            mimetype="application/octet-stream",
+            direct_passthrough=True,
+        )
+        if "Content-Length" in upstream.headers:
+            response.content_length = int(upstream.headers["Content-Length"])
+        response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+        return response
+
+    def evict(self):
+        """Remove the least recently used files until the cache fits in max_size."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(PART_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _path(self, sha256):
+        return os.path.join(self.directory, sha256)
+
+    def _claim(self, sha256):
+        """Create the partial file for sha256, None if another request already has it."""
+        part_path = self._path(sha256) + PART_SUFFIX
+        for _ in range(2):
+            try:
+                return open(part_path, "xb")
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(part_path) < STALE_PART_SECONDS:
+                        return None
+                    os.remove(part_path)
+                except FileNotFoundError:
+                    pass
+        return None
+
+    def _open(self, url, sha256, part, timeout, logger):
+        try:
+            upstream = self.session.get(url, stream=True, timeout=timeout)
+            upstream.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning(f"Can't cache installer from {url}: {e}")
+            self._discard(part)
+            return None
+        if int(upstream.headers.get("Content-Length", 0)) > self.max_size:
+            upstream.close()
+            self._discard(part)
+            return None
+        return upstream
+
+    def _copy(self, upstream, url, sha256, part, logger):
+        """Yield the upstream body while writing it to part, it's only kept if it matches sha256."""
+        digest = hashlib.sha256()
+        complete = False
+        try:
+            for chunk in upstream.iter_content(CHUNK_SIZE):
+                part.write(chunk)
+                digest.update(chunk)
+                yield chunk
+            complete = True
+        finally:
+            upstream.close()
+            part.close()
+            if complete and digest.hexdigest() == sha256:
+                os.replace(part.name, self._path(sha256))
+                logger.info(f"Cached installer {sha256} from {url}")
+                self.evict()
+            else:
+                if complete:
+                    logger.error(f"Installer from {url} doesn't match its SHA256, not caching it")
+                os.remove(part.name)
+
+    def _fill(self, url, sha256, part, timeout, logger):
+        upstream = self._open(url, sha256, part, timeout, logger)
+        if upstream is None:
+            return
+        try:
+            for _ in self._copy(upstream, url, sha256, part, logger):
+                pass
+        except (OSError, requests.RequestException) as e:
+            logger.warning(f"Can't cache installer from {url}: {e}")
+
+    @staticmethod
+    def _discard(part):
+        part.close()
+        os.remove(part.name)
+
+
+installer_cache = InstallerCache()
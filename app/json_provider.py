@@ -0,0 +1,47 @@
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder is used without it
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes with orjson when it is installed.
+
+    orjson writes bytes straight from the dicts we build, so responses skip the
+    str round trip of the stdlib encoder. Output stays the same as Flask's:
+    sorted keys, and datetimes as HTTP dates through DefaultJSONProvider.default.
+    Anything orjson can't encode falls back to the stdlib encoder.
+    """
+
+    def dumps_bytes(self, obj):
+        """Serialize obj to compact UTF-8 JSON bytes."""
+        if orjson is not None:
+            option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            try:
+                return orjson.dumps(obj, default=self.default, option=option)
+            except TypeError:
+                pass
+        return json.dumps(
+            obj,
+            default=self.default,
+            ensure_ascii=self.ensure_ascii,
+            sort_keys=self.sort_keys,
+            separators=(",", ":"),
+        ).encode()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self._app.debug:
+            return super().response(obj)
+        return self._app.response_class(self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,165 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.models import Package
+from app.settings import get_setting
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, exports just aren't serialized there
+    fcntl = None
+
+STATE_FILE = ".mirror-state.json"
+LOCK_FILE = ".mirror.lock"
+BATCH_SIZE = 100
+
+mirror_cli = AppGroup("mirror", help="Export the winget REST API as static files.")
+
+
+def write_atomic(path, data):
+    """Write data to path so readers either see the old or the new file, never half of one."""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def is_safe_file_name(identifier):
+    return identifier not in (".", "..") and "/" not in identifier and "\\" not in identifier
+
+
+def load_state(directory, base_url):
+    try:
+        with open(os.path.join(directory, STATE_FILE)) as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return {"base_url": base_url, "packages": {}}
+    # Installer URLs contain the base URL, so everything has to be rewritten when it changes
+    if state.get("base_url") != base_url:
+        return {"base_url": base_url, "packages": {}}
+    return state
+
+
+def export_mirror(directory, base_url):
+    """Write information, packageManifests/<identifier> and manifestSearch to directory.
+
+    Only packages whose revision changed since the last export are rendered
+    again, packages that no longer exist are removed. Returns the number of
+    manifests written.
+    """
+    manifests_directory = os.path.join(directory, "packageManifests")
+    os.makedirs(manifests_directory, exist_ok=True)
+    state = load_state(directory, base_url)
+    previous = state["packages"]
+    packages = {}
+    written = 0
+
+    with current_app.test_request_context(base_url=base_url):
+        write_atomic(
+            os.path.join(directory, "information"),
+            current_app.json.dumps_bytes(
+                {"Data": {"SourceIdentifier": get_setting("REPO_NAME"), "ServerSupportedVersions": ["1.4.0", "1.5.0"]}}
+            ),
+        )
+
+        changed = []
+        for package in Package.query.order_by(Package.id):
+            if not is_safe_file_name(package.identifier):
+                current_app.logger.warning(f"Skipping package with unsafe identifier: {package.identifier}")
+                continue
+            entry = previous.get(package.identifier)
+            path = os.path.join(manifests_directory, package.identifier)
+            if entry and entry["revision"] == package.revision and os.path.exists(path):
+                packages[package.identifier] = entry
+            else:
+                changed.append(package)
+
+        for start in range(0, len(changed), BATCH_SIZE):
+            for package in Package.load_manifests(changed[start:start + BATCH_SIZE]):
+                write_atomic(
+                    os.path.join(manifests_directory, package.identifier),
+                    current_app.json.dumps_bytes(package.generate_output()),
+                )
+                search_entry = package.generate_output_manifest_search()
+                packages[package.identifier] = {
+                    "revision": package.revision,
+                    "search": search_entry if search_entry["Versions"] else None,
+                }
+                written += 1
+
+        for identifier in set(previous) - set(packages):
+            path = os.path.join(manifests_directory, identifier)
+            if os.path.exists(path):
+                os.remove(path)
+
+        search_index = [entry["search"] for _, entry in sorted(packages.items()) if entry["search"]]
+        write_atomic(os.path.join(directory, "manifestSearch"), current_app.json.dumps_bytes({"Data": search_index}))
+
+    state["packages"] = packages
+    write_atomic(os.path.join(directory, STATE_FILE), json.dumps(state).encode())
+    return written
+
+
+def export_mirror_locked(directory, base_url):
+    """Run export_mirror unless another worker is already exporting to the same directory."""
+    os.makedirs(directory, exist_ok=True)
+    if fcntl is None:
+        return export_mirror(directory, base_url)
+    with open(os.path.join(directory, LOCK_FILE), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            return export_mirror(directory, base_url)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def start_mirror_job(app):
+    """Re-export the mirror configured with MIRROR_DIR every MIRROR_INTERVAL seconds in the background."""
+    directory = app.config.get("MIRROR_DIR")
+    base_url = app.config.get("MIRROR_BASE_URL")
+    if not directory or not base_url:
+        return
+    interval = int(app.config.get("MIRROR_INTERVAL", 60))
+
+    def run():
+        while True:
+            with app.app_context():
+                try:
+                    written = export_mirror_locked(directory, base_url)
+                    if written:
+                        app.logger.info(f"Mirror updated, {written} manifests written")
+                except Exception as e:
+                    app.logger.error(f"Mirror export failed: {e}")
+            time.sleep(interval)
+
+    threading.Thread(target=run, name="mirror-export", daemon=True).start()
+
+
+@mirror_cli.command("export")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--base-url", help="External URL of WinGetty, used for installer URLs. Defaults to MIRROR_BASE_URL.")
+def export_command(directory, base_url):
+    """Write the winget REST API for every package to DIRECTORY."""
+    base_url = base_url or current_app.config.get("MIRROR_BASE_URL")
+    if not base_url:
+        raise click.UsageError("Pass --base-url or set MIRROR_BASE_URL.")
+    written = export_mirror_locked(directory, base_url)
+    if written is None:
+        raise click.ClickException("Another export to this directory is running.")
+    click.echo(f"{written} manifests written to {directory}")
@@ -1,23 +1,112 @@
 import dataclasses
+import functools
+import hashlib
 from datetime import datetime
 from distutils.version import LooseVersion
 import json
+from urllib.parse import quote
 from app import db, bcrypt
-from flask import url_for, current_app
+from flask import url_for, current_app, has_request_context, request
 import os
+from sqlalchemy.orm import selectinload
 from flask_login import UserMixin
 
 
+# Same characters werkzeug leaves unquoted when building a path segment
+URL_SEGMENT_SAFE = "!$&'()*+,/:;=@"
+
+
+@functools.lru_cache(maxsize=32)
+def _download_url_template(url_root):
+    # Route once with placeholder values, the result only depends on the host the request came in on
+    url = url_for(
+        "api.download",
+        identifier="__identifier__",
+        version="__version__",
+        architecture="__architecture__",
+        scope="__scope__",
+        _external=True,
+        _scheme="https",
+    )
+    url = url.replace("{", "{{").replace("}", "}}")
+    for field in ("identifier", "version", "architecture", "scope"):
+        url = url.replace(f"__{field}__", f"{{{field}}}")
+    return url
+
+
+def installer_url(identifier, version, architecture, scope):
+    """External download URL of an installer, what url_for('api.download', ...) would return."""
+    url_root = request.url_root if has_request_context() else current_app.config.get("SERVER_NAME")
+    return _download_url_template(url_root).format(
+        identifier=quote(identifier, safe=URL_SEGMENT_SAFE),
+        version=quote(version, safe=URL_SEGMENT_SAFE),
+        architecture=quote(architecture, safe=URL_SEGMENT_SAFE),
+        scope=quote(scope, safe=URL_SEGMENT_SAFE),
+    )
+
+
 @dataclasses.dataclass
 class Package(db.Model):
+    # ETags are built from the id and revision, an id must never be handed out again after a delete
+    __table_args__ = {"sqlite_autoincrement": True}
+
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     identifier = db.Column(db.String(255), unique=True, nullable=False)
     name = db.Column(db.String(255), nullable=False)
     publisher = db.Column(db.String(255), nullable=False)
+    moniker = db.Column(db.String(100), nullable=True, index=True)
+    tags = db.relationship(
+        "PackageTag", cascade="all, delete-orphan"
+    )
     versions = db.relationship(
         "PackageVersion", backref="package", cascade="all, delete-orphan"
     )
+    search_grams = db.relationship(
+        "PackageSearchGram", cascade="all, delete-orphan"
+    )
     download_count = db.Column(db.Integer, default=0)
+    # Bumped on every change to the package or its versions/installers, used for ETags
+    revision = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    def touch(self):
+        # Let the database do the increment so concurrent edits don't get lost
+        self.revision = Package.revision + 1
+
+    @staticmethod
+    def make_etag(*parts):
+        return hashlib.sha1("\0".join(str(part) for part in parts).encode()).hexdigest()
+
+    @staticmethod
+    def manifest_options():
+        """Loader options that fetch versions, installers, switches and nested files
+        in one query per level instead of one per parent."""
+        versions = selectinload(Package.versions)
+        installers = versions.selectinload(PackageVersion.installers)
+        return [
+            selectinload(Package.tags),
+            versions.selectinload(PackageVersion.package),
+            installers.selectinload(Installer.switches),
+            installers.selectinload(Installer.nested_installer_files),
+        ]
+
+    @staticmethod
+    def load_manifests(packages):
+        """Load the manifest graph of already queried packages and return them in the same order."""
+        ids = [package.id for package in packages]
+        if not ids:
+            return []
+        loaded = {
+            package.id: package
+            for package in Package.query.options(*Package.manifest_options()).filter(Package.id.in_(ids))
+        }
+        return [loaded[id] for id in ids]
+
+    def manifest_etag(self, host_url):
+        # Installer URLs are absolute so the host is part of the representation
+        return Package.make_etag(self.id, self.revision, host_url)
+
+    def set_tags(self, tags):
+        self.tags = [PackageTag(tag=tag) for tag in dict.fromkeys(tags) if tag]
 
     def to_dict(self):
         return {
@@ -25,6 +114,8 @@ class Package(db.Model):
             "identifier": self.identifier,
             "name": self.name,
             "publisher": self.publisher,
+            "moniker": self.moniker,
+            "tags": [tag.tag for tag in self.tags],
             "download_count": self.download_count,
             "versions": sorted(
                 [version.to_dict() for version in self.versions],
@@ -56,31 +147,31 @@ class Package(db.Model):
         return version_data
 
     def _get_default_locale(self, version):
-        return {
+        default_locale = {
             "PackageLocale": version.package_locale,
             "Publisher": self.publisher,
             "PackageName": self.name,
             "ShortDescription": version.short_description,
         }
+        if self.moniker:
+            default_locale["Moniker"] = self.moniker
+        if self.tags:
+            default_locale["Tags"] = [tag.tag for tag in self.tags]
+        return default_locale
 
     def _get_installer_data(self, version):
         installer_data = []
         for installer in version.installers:
+            installer_download_url = installer_url(
+                self.identifier, version.version_code, installer.architecture, installer.scope
+            )
             if installer.scope == "both":
                 # If installer is for both user and machine, create two entries for each scope (user and machine) but use it with download url
                 for scope in ["user", "machine"]:
                     data = {
                         "Architecture": installer.architecture,
                         "InstallerType": installer.installer_type,
-                        "InstallerUrl": url_for(
-                            "api.download",
-                            identifier=self.identifier,
-                            version=version.version_code,
-                            architecture=installer.architecture,
-                            scope=installer.scope,
-                            _external=True,
-                            _scheme="https",
-                        ),
+                        "InstallerUrl": installer_download_url,
                         "InstallerSha256": installer.installer_sha256,
                         "Scope": scope,
                         "InstallerSwitches": self._get_installer_switches(installer),
@@ -90,20 +181,13 @@ class Package(db.Model):
                         data["NestedInstallerFiles"] = self._get_nested_installer_data(
                             installer
                         )
+                    self._add_correlation_data(data, installer)
                     installer_data.append(data)
             else:
                 data = {
                     "Architecture": installer.architecture,
                     "InstallerType": installer.installer_type,
-                    "InstallerUrl": url_for(
-                        "api.download",
-                        identifier=self.identifier,
-                        version=version.version_code,
-                        architecture=installer.architecture,
-                        scope=installer.scope,
-                        _external=True,
-                        _scheme="https",
-                    ),
+                    "InstallerUrl": installer_download_url,
                     "InstallerSha256": installer.installer_sha256,
                     "Scope": installer.scope,
                     "InstallerSwitches": self._get_installer_switches(installer),
@@ -113,9 +197,16 @@ class Package(db.Model):
                     data["NestedInstallerFiles"] = self._get_nested_installer_data(
                         installer
                     )
+                self._add_correlation_data(data, installer)
                 installer_data.append(data)
         return installer_data
 
+    def _add_correlation_data(self, data, installer):
+        if installer.product_code:
+            data["ProductCode"] = installer.product_code
+        if installer.package_family_name:
+            data["PackageFamilyName"] = installer.package_family_name
+
     def _get_installer_switches(self, installer):
         switches = {}
         for switch in installer.switches:
@@ -132,6 +223,30 @@ class Package(db.Model):
             nested_installer_data.append(data)
         return nested_installer_data
 
+    def generate_singleton_manifests(self):
+        """Return (version, manifest) for every version with installers, as singleton manifests
+        for the pre-indexed source."""
+        manifests = []
+        for version in self.versions:
+            installers = self._get_installer_data(version)
+            if not installers:
+                continue
+            for installer in installers:
+                if not installer["InstallerSwitches"]:
+                    del installer["InstallerSwitches"]
+            manifest = {
+                "PackageIdentifier": self.identifier,
+                "PackageVersion": version.version_code,
+                **self._get_default_locale(version),
+                # Required by the manifest schema, WinGetty doesn't keep track of licenses
+                "License": "Proprietary",
+                "Installers": installers,
+                "ManifestType": "singleton",
+                "ManifestVersion": "1.4.0",
+            }
+            manifests.append((version, manifest))
+        return manifests
+
     def generate_output_manifest_search(self):
         output = {
             "PackageIdentifier": self.identifier,
@@ -142,6 +257,13 @@ class Package(db.Model):
 
         for version in self.versions:
             version_data = {"PackageVersion": version.version_code}
+            # Lets winget correlate installed apps with this version
+            product_codes = {installer.product_code for installer in version.installers if installer.product_code}
+            package_family_names = {installer.package_family_name for installer in version.installers if installer.package_family_name}
+            if product_codes:
+                version_data["ProductCodes"] = sorted(product_codes)
+            if package_family_names:
+                version_data["PackageFamilyNames"] = sorted(package_family_names)
             # Only append version if there's at least one installer
             if version.installers:
                 output["Versions"].append(version_data)
@@ -149,14 +271,30 @@ class Package(db.Model):
         return output
 
 
+class PackageSearchGram(db.Model):
+    __table_args__ = (db.Index("ix_package_search_gram_lookup", "field", "gram", "package_id"),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    package_id = db.Column(db.Integer, db.ForeignKey("package.id"), index=True)
+    field = db.Column(db.String(50), nullable=False)
+    gram = db.Column(db.String(3), nullable=False)
+
+
+class PackageTag(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    package_id = db.Column(db.Integer, db.ForeignKey("package.id"), index=True)
+    tag = db.Column(db.String(100), nullable=False, index=True)
+
+
 class PackageVersion(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    identifier = db.Column(db.String(50), db.ForeignKey("package.identifier"))
+    identifier = db.Column(db.String(50), db.ForeignKey("package.identifier"), index=True)
     version_code = db.Column(db.String(50))
     default_locale = db.Column(db.String(50))
     package_locale = db.Column(db.String(50))
     short_description = db.Column(db.String(50))
     date_added = db.Column(db.DateTime, default=datetime.now())
+    download_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     installers = db.relationship("Installer", backref="package_version", lazy=True)
 
     def to_dict(self):
@@ -168,6 +306,7 @@ class PackageVersion(db.Model):
             "package_locale": self.package_locale,
             "short_description": self.short_description,
             "date_added": self.date_added,
+            "download_count": self.download_count,
             "installers": [installer.to_dict() for installer in self.installers],
             "package_id": self.package.id,
         }
@@ -175,13 +314,16 @@ class PackageVersion(db.Model):
 
 class Installer(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    version_id = db.Column(db.Integer, db.ForeignKey("package_version.id"))
+    version_id = db.Column(db.Integer, db.ForeignKey("package_version.id"), index=True)
     architecture = db.Column(db.String(50))
     installer_type = db.Column(db.String(50))
     file_name = db.Column(db.String(100), nullable=True)
     external_url = db.Column(db.String(255), nullable=True)
-    installer_sha256 = db.Column(db.String(100))
+    installer_sha256 = db.Column(db.String(100), index=True)
     scope = db.Column(db.String(50))
+    product_code = db.Column(db.String(255), nullable=True, index=True)
+    package_family_name = db.Column(db.String(255), nullable=True, index=True)
+    download_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     switches = db.relationship("InstallerSwitch", backref="installer", lazy=True)
     nested_installer_type = db.Column(db.String(50), nullable=True)
     nested_installer_files = db.relationship(
@@ -200,8 +342,11 @@ class Installer(db.Model):
             "external_url": self.external_url,
             "installer_sha256": self.installer_sha256,
             "scope": self.scope,
+            "product_code": self.product_code,
+            "package_family_name": self.package_family_name,
+            "download_count": self.download_count,
             "switches": [switch.to_dict() for switch in self.switches],
-            "installer_url": url_for('api.download', identifier=self.package_version.package.identifier, version=self.package_version.version_code, architecture=self.architecture, scope=self.scope, _external=True, _scheme='https')
+            "installer_url": installer_url(self.package_version.package.identifier, self.package_version.version_code, self.architecture, self.scope)
         }
 
     def to_json(self):
@@ -220,7 +365,7 @@ class Installer(db.Model):
 
 class NestedInstallerFile(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    installer_id = db.Column(db.Integer, db.ForeignKey("installer.id"))
+    installer_id = db.Column(db.Integer, db.ForeignKey("installer.id"), index=True)
     relative_file_path = db.Column(db.String(255))
     portable_command_alias = db.Column(db.String(100))
 
@@ -243,7 +388,7 @@ class NestedInstallerFile(db.Model):
 
 class InstallerSwitch(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    installer_id = db.Column(db.Integer, db.ForeignKey("installer.id"))
+    installer_id = db.Column(db.Integer, db.ForeignKey("installer.id"), index=True)
     parameter = db.Column(db.String(50))
     value = db.Column(db.String(255))
 
@@ -345,13 +490,19 @@ class Setting(db.Model):
         else:
             self.value = value
 
+    @staticmethod
+    def config_overrides():
+        # Upper cased view of app.config, built once by load_config_overrides
+        return current_app.extensions.get("setting_overrides", {})
+
     def get_value(self):
         # Convert self.key to uppercase for case-insensitive comparison
         upper_key = self.key.upper()
+        overrides = Setting.config_overrides()
 
         # First, check if the setting is defined in app.config in a case-insensitive manner
-        if upper_key in (k.upper() for k in current_app.config):
-            app_config_value = current_app.config[upper_key]
+        if upper_key in overrides:
+            app_config_value = overrides[upper_key]
             # Return the app config value, converting it to the correct type
             if self.type == "integer":
                 return int(app_config_value)
@@ -389,5 +540,35 @@ class Setting(db.Model):
             "type": self.type,
             "value": self.get_value(),
             "depends_on": self.depends_on,
-            "is_env": upper_key in (k.upper() for k in current_app.config)
+            "is_env": upper_key in Setting.config_overrides()
         }
+
+
+class CacheGeneration(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Blob(db.Model):
+    """Lock row of a stored installer file, linking installers to the file and removing
+    it are serialized on it (see BlobStore.lock). Removed together with the file."""
+    sha256 = db.Column(db.String(64), primary_key=True)
+
+
+class DownloadStat(db.Model):
+    """Downloads per time bucket. Rows are only ever appended (and rolled up into
+    coarser periods), the counts of all rows for the same bucket add up."""
+    __table_args__ = (
+        db.Index("ix_download_stat_package", "package_id", "bucket"),
+        db.Index("ix_download_stat_period", "period", "bucket"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # "minute", "hour" or "day"
+    period = db.Column(db.String(10), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    package_id = db.Column(db.Integer, nullable=False)
+    version_id = db.Column(db.Integer, nullable=False)
+    installer_id = db.Column(db.Integer, nullable=False)
+    architecture = db.Column(db.String(50))
+    count = db.Column(db.Integer, nullable=False)
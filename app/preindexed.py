@@ -0,0 +1,355 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import db
+from app.mirror import fcntl, is_safe_file_name, write_atomic
+from app.models import CacheGeneration, Package
+
+INDEX_PATH = os.path.join("Public", "index.db")
+STATE_FILE = ".preindexed-state.json"
+LOCK_FILE = ".preindexed.lock"
+BATCH_SIZE = 100
+
+# Schema 1.1 of the winget pre-indexed source index
+SCHEMA = """
+CREATE TABLE metadata(name TEXT PRIMARY KEY NOT NULL, value TEXT NOT NULL);
+CREATE TABLE ids(id TEXT NOT NULL);
+CREATE UNIQUE INDEX ids_pkindex ON ids(id);
+CREATE TABLE names(name TEXT NOT NULL);
+CREATE UNIQUE INDEX names_pkindex ON names(name);
+CREATE TABLE monikers(moniker TEXT NOT NULL);
+CREATE UNIQUE INDEX monikers_pkindex ON monikers(moniker);
+CREATE TABLE versions(version TEXT NOT NULL);
+CREATE UNIQUE INDEX versions_pkindex ON versions(version);
+CREATE TABLE channels(channel TEXT NOT NULL);
+CREATE UNIQUE INDEX channels_pkindex ON channels(channel);
+CREATE TABLE pathparts(parent INT64, pathpart TEXT NOT NULL);
+CREATE UNIQUE INDEX pathparts_pkindex ON pathparts(parent, pathpart);
+CREATE TABLE manifest(
+    id INT64 NOT NULL, name INT64 NOT NULL, moniker INT64 NOT NULL, version INT64 NOT NULL,
+    channel INT64 NOT NULL, pathpart INT64 NOT NULL, hash BLOB
+);
+CREATE UNIQUE INDEX manifest_pkindex ON manifest(id, version, channel);
+CREATE INDEX manifest_id_index ON manifest(id);
+CREATE INDEX manifest_name_index ON manifest(name);
+CREATE INDEX manifest_moniker_index ON manifest(moniker);
+CREATE INDEX manifest_pathpart_index ON manifest(pathpart);
+"""
+
+# One value table plus a manifest map per multi-valued field, (table, column)
+MAPPED_FIELDS = [
+    ("tags", "tag"),
+    ("commands", "command"),
+    ("pfns", "pfn"),
+    ("productcodes", "productcode"),
+    ("norm_names", "norm_name"),
+    ("norm_publishers", "norm_publisher"),
+]
+
+VALUE_FIELDS = [("ids", "id"), ("names", "name"), ("monikers", "moniker"), ("versions", "version"), ("channels", "channel")]
+
+preindexed_cli = AppGroup("preindexed", help="Build the pre-indexed winget source.")
+
+
+def create_schema(connection):
+    connection.executescript(SCHEMA)
+    for table, column in MAPPED_FIELDS:
+        connection.executescript(
+            f"""
+            CREATE TABLE {table}({column} TEXT NOT NULL);
+            CREATE UNIQUE INDEX {table}_pkindex ON {table}({column});
+            CREATE TABLE {table}_map(manifest INT64 NOT NULL, {column} INT64 NOT NULL, PRIMARY KEY({column}, manifest)) WITHOUT ROWID;
+            CREATE INDEX {table}_map_index ON {table}_map(manifest);
+            """
+        )
+    connection.executemany(
+        "INSERT INTO metadata(name, value) VALUES (?, ?)", [("majorVersion", "1"), ("minorVersion", "1")]
+    )
+
+
+def normalize(value):
+    # Close enough to winget's name normalization for lookups: lowercase, letters and digits only
+    return re.sub(r"[\W_]+", "", (value or "").lower())
+
+
+def value_id(connection, table, column, value):
+    connection.execute(f"INSERT OR IGNORE INTO {table}({column}) VALUES (?)", (value,))
+    return connection.execute(f"SELECT rowid FROM {table} WHERE {column} = ?", (value,)).fetchone()[0]
+
+
+def pathpart_id(connection, relative_path):
+    parent = None
+    for part in relative_path.split("/"):
+        row = connection.execute(
+            "SELECT rowid FROM pathparts WHERE parent IS ? AND pathpart = ?", (parent, part)
+        ).fetchone()
+        if row is None:
+            parent = connection.execute(
+                "INSERT INTO pathparts(parent, pathpart) VALUES (?, ?)", (parent, part)
+            ).lastrowid
+        else:
+            parent = row[0]
+    return parent
+
+
+def manifest_path(identifier, version, digest):
+    # Same layout as the community repository, the file name is the manifest hash so a path never changes content
+    if not is_safe_file_name(identifier) or not is_safe_file_name(version):
+        raise ValueError(f"Unsafe manifest path for {identifier} {version}")
+    return "/".join(["manifests", identifier[0].lower(), *identifier.split("."), version, f"{digest[:16]}.yaml"])
+
+
+def add_manifest(connection, package, version, manifest, body):
+    digest = hashlib.sha256(body).hexdigest()
+    path = manifest_path(package.identifier, version.version_code, digest)
+    rowid = connection.execute(
+        "INSERT INTO manifest(id, name, moniker, version, channel, pathpart, hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            value_id(connection, "ids", "id", package.identifier),
+            value_id(connection, "names", "name", package.name),
+            value_id(connection, "monikers", "moniker", package.moniker or ""),
+            value_id(connection, "versions", "version", version.version_code),
+            value_id(connection, "channels", "channel", ""),
+            pathpart_id(connection, path),
+            bytes.fromhex(digest),
+        ),
+    ).lastrowid
+
+    installers = manifest["Installers"]
+    values = {
+        "tags": manifest.get("Tags", []),
+        "commands": [
+            nested_file["PortableCommandAlias"]
+            for installer in installers
+            for nested_file in installer.get("NestedInstallerFiles", [])
+            if nested_file.get("PortableCommandAlias")
+        ],
+        "pfns": [installer["PackageFamilyName"] for installer in installers if "PackageFamilyName" in installer],
+        "productcodes": [installer["ProductCode"] for installer in installers if "ProductCode" in installer],
+        "norm_names": [normalize(package.name)],
+        "norm_publishers": [normalize(package.publisher)],
+    }
+    for table, column in MAPPED_FIELDS:
+        for value in set(values[table]):
+            connection.execute(
+                f"INSERT OR IGNORE INTO {table}_map(manifest, {column}) VALUES (?, ?)",
+                (rowid, value_id(connection, table, column, value)),
+            )
+    return path
+
+
+def remove_package(connection, identifier):
+    rowids = [
+        row[0]
+        for row in connection.execute(
+            "SELECT manifest.rowid FROM manifest JOIN ids ON ids.rowid = manifest.id WHERE ids.id = ?", (identifier,)
+        )
+    ]
+    for rowid in rowids:
+        for table, _ in MAPPED_FIELDS:
+            connection.execute(f"DELETE FROM {table}_map WHERE manifest = ?", (rowid,))
+        connection.execute("DELETE FROM manifest WHERE rowid = ?", (rowid,))
+
+
+def prune(connection):
+    """Drop values and path parts no manifest refers to anymore."""
+    for table, column in VALUE_FIELDS:
+        connection.execute(f"DELETE FROM {table} WHERE rowid NOT IN (SELECT {column} FROM manifest)")
+    for table, column in MAPPED_FIELDS:
+        connection.execute(f"DELETE FROM {table} WHERE rowid NOT IN (SELECT {column} FROM {table}_map)")
+    while connection.execute(
+        """DELETE FROM pathparts WHERE rowid NOT IN (SELECT pathpart FROM manifest)
+        AND rowid NOT IN (SELECT parent FROM pathparts WHERE parent IS NOT NULL)"""
+    ).rowcount:
+        pass
+
+
+def load_state(directory, base_url):
+    try:
+        with open(os.path.join(directory, STATE_FILE)) as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        state = None
+    if state and state.get("base_url") == base_url and os.path.exists(os.path.join(directory, INDEX_PATH)):
+        state.setdefault("retired", {})
+        return state
+    # Installer URLs contain the base URL, so everything has to be rebuilt when it changes. The
+    # manifests of the old build are retired rather than removed, a signed source.msix may still point to them
+    retired = {}
+    if state:
+        retired = state.get("retired", {})
+        for entry in state.get("packages", {}).values():
+            for path in entry["manifests"]:
+                retired.setdefault(path, time.time())
+    return {"base_url": base_url, "generation": None, "packages": {}, "retired": retired}
+
+
+def manifests_generation():
+    # Bumped by every write to a package, see manifest_cache.invalidate()
+    return db.session.query(CacheGeneration.value).filter_by(name="manifests").scalar() or 0
+
+
+def build_index(directory, base_url):
+    """Build or update Public/index.db and the manifests it points to in directory.
+
+    Installer URLs are built for base_url. Only packages whose revision changed
+    since the last build are indexed again. Returns the number of packages written.
+    """
+    generation = manifests_generation()
+    state = load_state(directory, base_url)
+    previous = state["packages"]
+    packages = {}
+    changed = []
+
+    for package in Package.query.order_by(Package.id):
+        if not is_safe_file_name(package.identifier):
+            current_app.logger.warning(f"Skipping package with unsafe identifier: {package.identifier}")
+            continue
+        entry = previous.get(package.identifier)
+        if entry and entry["revision"] == package.revision:
+            packages[package.identifier] = entry
+        else:
+            changed.append(package)
+    removed = [identifier for identifier in previous if identifier not in packages]
+
+    index_path = os.path.join(directory, INDEX_PATH)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), prefix=".tmp-")
+    os.close(fd)
+    try:
+        # Work on a copy so clients keep downloading the previous index until the new one is complete
+        if previous:
+            shutil.copyfile(index_path, tmp_path)
+        else:
+            os.truncate(tmp_path, 0)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            if not previous:
+                create_schema(connection)
+            for identifier in removed:
+                remove_package(connection, identifier)
+
+            with current_app.test_request_context(base_url=base_url):
+                for start in range(0, len(changed), BATCH_SIZE):
+                    for package in Package.load_manifests(changed[start:start + BATCH_SIZE]):
+                        remove_package(connection, package.identifier)
+                        paths = []
+                        for version, manifest in package.generate_singleton_manifests():
+                            if not is_safe_file_name(version.version_code):
+                                current_app.logger.warning(
+                                    f"Skipping version with unsafe version code: {package.identifier} {version.version_code}"
+                                )
+                                continue
+                            body = current_app.json.dumps_bytes(manifest)
+                            path = add_manifest(connection, package, version, manifest, body)
+                            file_path = os.path.join(directory, *path.split("/"))
+                            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                            write_atomic(file_path, body)
+                            paths.append(path)
+                        packages[package.identifier] = {"revision": package.revision, "manifests": paths}
+
+            prune(connection)
+            connection.commit()
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    # Manifests that aren't referenced anymore are kept for PREINDEXED_RETENTION seconds, clients
+    # still resolve them through the index inside the source.msix that was signed before this build
+    current = {path for entry in packages.values() for path in entry["manifests"]}
+    retired = {path: since for path, since in state["retired"].items() if path not in current}
+    for entry in previous.values():
+        for path in entry["manifests"]:
+            if path not in current:
+                retired.setdefault(path, time.time())
+    retention = int(current_app.config.get("PREINDEXED_RETENTION", 7 * 24 * 3600))
+    for path, since in list(retired.items()):
+        if time.time() - since >= retention:
+            try:
+                os.remove(os.path.join(directory, *path.split("/")))
+            except FileNotFoundError:
+                pass
+            del retired[path]
+
+    state.update(generation=generation, packages=packages, retired=retired)
+    write_atomic(os.path.join(directory, STATE_FILE), json.dumps(state).encode())
+    return len(changed)
+
+
+def preindexed_directory():
+    return current_app.config.get("PREINDEXED_DIR") or os.path.join(current_app.instance_path, "preindexed")
+
+
+def update_index(directory, base_url):
+    """Rebuild the index in directory if any package changed since it was built.
+
+    Only one worker builds at a time, returns the number of packages written or
+    None if the index is up to date or another worker is building it.
+    """
+    state = load_state(directory, base_url)
+    if state["generation"] is not None and state["generation"] == manifests_generation():
+        return None
+    os.makedirs(directory, exist_ok=True)
+    if fcntl is None:
+        return build_index(directory, base_url)
+    with open(os.path.join(directory, LOCK_FILE), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            return build_index(directory, base_url)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def start_preindexed_job(app):
+    """Rebuild the pre-indexed source in the background when packages changed, checked every PREINDEXED_INTERVAL seconds."""
+    base_url = app.config.get("MIRROR_BASE_URL")
+    if not base_url:
+        return
+    interval = int(app.config.get("PREINDEXED_INTERVAL", 60))
+
+    def run():
+        while True:
+            with app.app_context():
+                try:
+                    written = update_index(preindexed_directory(), base_url)
+                    if written is not None:
+                        app.logger.info(f"Pre-indexed source updated, {written} packages written")
+                except Exception as e:
+                    app.logger.error(f"Pre-indexed source build failed: {e}")
+            time.sleep(interval)
+
+    threading.Thread(target=run, name="preindexed-build", daemon=True).start()
+
+
+@preindexed_cli.command("build")
+@click.option("--base-url", help="External URL of WinGetty, used for installer URLs. Defaults to MIRROR_BASE_URL.")
+def build_command(base_url):
+    """Build the pre-indexed source in PREINDEXED_DIR."""
+    base_url = base_url or current_app.config.get("MIRROR_BASE_URL")
+    if not base_url:
+        raise click.UsageError("Pass --base-url or set MIRROR_BASE_URL.")
+    directory = preindexed_directory()
+    written = update_index(directory, base_url)
+    if written is None:
+        click.echo(f"Pre-indexed source in {directory} is up to date or being built")
+    else:
+        click.echo(f"{written} packages written to the pre-indexed source in {directory}")
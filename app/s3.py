@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+
+s3_client = boto3.client("s3")
+
+
+class PresignedURLCache:
+    """Per-worker cache of presigned S3 GET URLs.
+
+    Signing is CPU work, and during a rollout the same installer is signed for
+    every client. A URL is handed out again until S3_URL_EXPIRATION_MARGIN
+    seconds before it expires, so a client never gets a URL that is about to
+    stop working. A URL signed with temporary credentials (an instance or task
+    role, an assumed role) stops working when they expire, no matter its
+    ExpiresIn, so it isn't reused past that either.
+    """
+
+    def __init__(self, client, maxsize=4096):
+        self.client = client
+        self.maxsize = maxsize
+        self.expires_in = 3600
+        self.margin = 300
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.expires_in = int(app.config.get("S3_URL_EXPIRATION", self.expires_in))
+        self.margin = int(app.config.get("S3_URL_EXPIRATION_MARGIN", self.margin))
+
+    def credentials_expiry(self):
+        """Unix time the client's current credentials expire at, None if they don't."""
+        credentials = getattr(getattr(self.client, "_request_signer", None), "_credentials", None)
+        expiry_time = getattr(credentials, "_expiry_time", None)
+        return expiry_time.timestamp() if expiry_time is not None else None
+
+    def get_object_url(self, bucket, key, **params):
+        """Return a presigned GET URL for key in bucket, extra params are passed to get_object."""
+        cache_key = (bucket, key, tuple(sorted(params.items())))
+        now = time.time()
+        with self._lock:
+            cached = self._urls.get(cache_key)
+            if cached is not None and now < cached[1] - self.margin:
+                self._urls.move_to_end(cache_key)
+                return cached[0]
+
+        # Read before signing, credentials refreshed while signing only expire later
+        expires_at = now + self.expires_in
+        credentials_expiry = self.credentials_expiry()
+        if credentials_expiry is not None:
+            expires_at = min(expires_at, credentials_expiry)
+        url = self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket, "Key": key, **params},
+            ExpiresIn=self.expires_in,
+        )
+        if now >= expires_at - self.margin:
+            return url
+        with self._lock:
+            self._urls[cache_key] = (url, expires_at)
+            self._urls.move_to_end(cache_key)
+            while len(self._urls) > self.maxsize:
+                self._urls.popitem(last=False)
+        return url
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+
+presigned_urls = PresignedURLCache(s3_client)
@@ -0,0 +1,133 @@
+from sqlalchemy import and_, func, or_, select
+
+from app import db
+from app.models import Installer, Package, PackageSearchGram, PackageTag, PackageVersion
+
+GRAM_SIZE = 3
+
+
+def make_grams(value):
+    """Return the set of lowercase trigrams in value."""
+    value = (value or "").lower()
+    return {value[i:i + GRAM_SIZE] for i in range(len(value) - GRAM_SIZE + 1)}
+
+
+def installer_packages(condition):
+    """Subquery of the identifiers of packages with an installer matching condition."""
+    return (
+        select(PackageVersion.identifier)
+        .join(Installer, Installer.version_id == PackageVersion.id)
+        .where(condition)
+    )
+
+
+def match_exact(field, keywords):
+    """Return a filter clause for packages where field equals any of keywords.
+
+    Every field is backed by an index, so this is one indexed IN-list lookup
+    however many keywords are passed.
+    """
+    keywords = list(keywords)
+    if field == "tags":
+        return Package.id.in_(select(PackageTag.package_id).where(PackageTag.tag.in_(keywords)))
+    if field in ("product_code", "package_family_name"):
+        return Package.identifier.in_(installer_packages(getattr(Installer, field).in_(keywords)))
+    return getattr(Package, field).in_(keywords)
+
+
+class SearchBackend:
+    """Plain case-insensitive LIKE matching, scans the whole package table."""
+
+    def update(self, package):
+        pass
+
+    def match(self, keyword, fields):
+        return or_(*(self._like(field, keyword) for field in fields))
+
+    def _like(self, field, keyword):
+        pattern = f"%{keyword}%"
+        if field == "tags":
+            return Package.tags.any(PackageTag.tag.ilike(pattern))
+        if field in ("product_code", "package_family_name"):
+            return Package.identifier.in_(installer_packages(getattr(Installer, field).ilike(pattern)))
+        return getattr(Package, field).ilike(pattern)
+
+
+class TrigramSearchBackend(SearchBackend):
+    """PostgreSQL backend, ILIKE is answered from the pg_trgm GIN indexes so there is nothing to maintain."""
+
+
+class NgramSearchBackend(SearchBackend):
+    """Inverted trigram index kept in the package_search_gram table.
+
+    A keyword only matches packages that contain all of its trigrams in one of
+    the searched fields, the LIKE is then only evaluated on those candidates
+    to weed out false positives.
+    """
+
+    fields = ["name", "identifier", "publisher", "moniker", "tags"]
+
+    def update(self, package):
+        package.search_grams = [
+            PackageSearchGram(field=field, gram=gram)
+            for field in self.fields
+            for gram in set().union(*map(make_grams, self._values(package, field)))
+        ]
+
+    def match(self, keyword, fields):
+        grams = make_grams(keyword)
+        indexed = [field for field in fields if field in self.fields]
+        if not grams or not indexed:
+            # Keywords shorter than a trigram can't use the index
+            return super().match(keyword, fields)
+
+        candidates = (
+            select(PackageSearchGram.package_id)
+            .where(
+                PackageSearchGram.field.in_(indexed),
+                PackageSearchGram.gram.in_(grams),
+            )
+            .group_by(PackageSearchGram.package_id, PackageSearchGram.field)
+            .having(func.count(func.distinct(PackageSearchGram.gram)) == len(grams))
+        )
+        clauses = [and_(Package.id.in_(candidates), super().match(keyword, indexed))]
+        unindexed = [field for field in fields if field not in self.fields]
+        if unindexed:
+            clauses.append(super().match(keyword, unindexed))
+        return or_(*clauses)
+
+    def _values(self, package, field):
+        if field == "tags":
+            return [tag.tag for tag in package.tags]
+        return [getattr(package, field)]
+
+
+class SearchIndex:
+    """Entry point used by the routes, delegates to the backend that fits the database."""
+
+    backends = {
+        "like": SearchBackend,
+        "ngram": NgramSearchBackend,
+        "pg_trgm": TrigramSearchBackend,
+    }
+
+    def __init__(self):
+        self.backend = SearchBackend()
+
+    def init_app(self, app):
+        name = app.config.get("SEARCH_BACKEND")
+        if not name:
+            with app.app_context():
+                name = "pg_trgm" if db.engine.dialect.name == "postgresql" else "ngram"
+        self.backend = self.backends[name]()
+
+    def update(self, package):
+        """Refresh the index entries of a package, call this before committing a new or changed package."""
+        self.backend.update(package)
+
+    def match(self, keyword, fields):
+        """Return a filter clause for packages where any of fields contains keyword."""
+        return self.backend.match(keyword, fields)
+
+
+search_index = SearchIndex()
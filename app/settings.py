@@ -1,8 +1,46 @@
 from flask import current_app
 from app.models import Permission, Role, Setting, User
 from app import db
+from app.cache import SharedLRUCache
 from sqlalchemy.exc import IntegrityError
 
+# Holds a single entry with the typed value of every setting
+settings_cache = SharedLRUCache("settings", maxsize=1)
+
+
+def get_settings():
+    """Return the typed value of every setting keyed by upper case key.
+    Loaded once per worker and reloaded on all workers after update_setting."""
+    settings = settings_cache.get("all")
+    if settings is None:
+        settings = {setting.key.upper(): setting.get_value() for setting in Setting.query.all()}
+        settings_cache.set("all", settings)
+    return settings
+
+
+def get_setting(key):
+    return get_settings().get(key.upper())
+
+
+def load_config_overrides(app):
+    """Case-fold app.config once so Setting can resolve an environment override with a
+    single dict lookup. Call this again whenever the configuration is reloaded."""
+    app.extensions["setting_overrides"] = {key.upper(): app.config[key] for key in app.config}
+    settings_cache.init_app(app)
+    settings_cache.clear()
+
+
+def get_config(key, default=None):
+    """Look up a config value for hot paths, app.config goes through dynaconf which is
+    too slow to read on every request. Values are read once per worker."""
+    config = current_app.extensions.setdefault("config_cache", {})
+    try:
+        return config[key]
+    except KeyError:
+        value = config[key] = current_app.config.get(key, default)
+        return value
+
+
 
 def get_or_create(model, **kwargs):
     """Get an instance if it exists, otherwise create and return an instance.
@@ -62,8 +100,8 @@ def create_settings():
             "position": 3,
         },
         {
-            "name": "Enable uplink (W.I.P.)",
-            "description": "Enable this to use a public WinGet repository as an uplink.",
+            "name": "Enable uplink",
+            "description": "Enable this to use a public WinGet repository as an uplink for packages that aren't in this repository.",
             "key": "enable_uplink",
             "type": "boolean",
             "value": "False",
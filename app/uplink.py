@@ -0,0 +1,158 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import requests
+from flask import current_app
+
+from app.settings import get_setting
+
+UplinkResponse = namedtuple("UplinkResponse", ["status", "body", "etag", "fetched_at"])
+
+
+class _Call:
+    """An upstream request in flight that other requests for the same key can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class UplinkClient:
+    """Forwards winget REST requests to the uplink source configured in the settings.
+
+    Responses are kept in a bounded per-worker cache. They are served as is for
+    UPLINK_CACHE_TTL seconds and for another UPLINK_STALE_TTL seconds while a
+    background request refreshes them. Concurrent misses for the same request
+    wait for a single upstream call instead of each making their own. Under
+    gevent the threading primitives are patched, so this coalesces greenlets.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.ttl = 300
+        self.stale_ttl = 3600
+        self.timeout = 10
+        self.session = requests.Session()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.maxsize = int(app.config.get("UPLINK_CACHE_SIZE", self.maxsize))
+        self.ttl = float(app.config.get("UPLINK_CACHE_TTL", self.ttl))
+        self.stale_ttl = float(app.config.get("UPLINK_STALE_TTL", self.stale_ttl))
+        self.timeout = float(app.config.get("UPLINK_TIMEOUT", self.timeout))
+
+    @staticmethod
+    def base_url():
+        """URL of the uplink source, or None if the uplink is disabled."""
+        if not get_setting("ENABLE_UPLINK"):
+            return None
+        return (get_setting("UPLINK_URL") or "").rstrip("/") or None
+
+    def get(self, path):
+        return self._request("GET", path)
+
+    def post(self, path, data):
+        return self._request("POST", path, data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _request(self, method, path, data=None):
+        """Return the UplinkResponse for a request, or None if the uplink is disabled or unavailable."""
+        base_url = self.base_url()
+        if base_url is None:
+            return None
+        logger = current_app.logger
+        key = (method, base_url + path, data)
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+        if cached is not None:
+            age = time.monotonic() - cached.fetched_at
+            if age < self.ttl:
+                return cached
+            if age < self.ttl + self.stale_ttl:
+                self._refresh(key, self.timeout, logger)
+                return cached
+
+        try:
+            return self._fetch_once(key, self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"Uplink request to {key[1]} failed: {e}")
+            return None
+
+    def _refresh(self, key, timeout, logger):
+        """Refetch key in the background unless that's already happening."""
+        with self._lock:
+            if key in self._inflight:
+                return
+
+        def run():
+            try:
+                self._fetch_once(key, timeout)
+            except requests.RequestException as e:
+                logger.warning(f"Uplink refresh of {key[1]} failed, serving stale response: {e}")
+
+        threading.Thread(target=run, name="uplink-refresh", daemon=True).start()
+
+    def _fetch_once(self, key, timeout):
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if not leader:
+            call.done.wait(timeout)
+            if call.error is not None:
+                raise call.error
+            return call.response
+
+        try:
+            call.response = self._fetch(key, timeout)
+            if call.response is not None:
+                self._store(key, call.response)
+        except requests.RequestException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+        return call.response
+
+    def _fetch(self, key, timeout):
+        method, url, data = key
+        response = self.session.request(
+            method, url, data=data, headers={"Content-Type": "application/json"}, timeout=timeout
+        )
+        if response.status_code not in (200, 204):
+            # Don't cache errors, the next request tries again
+            raise requests.HTTPError(f"{response.status_code} {response.reason}", response=response)
+        body = response.content
+        return UplinkResponse(
+            status=response.status_code,
+            body=body,
+            etag=hashlib.sha1(body).hexdigest(),
+            fetched_at=time.monotonic(),
+        )
+
+    def _store(self, key, response):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+uplink = UplinkClient()
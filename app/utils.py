@@ -1,14 +1,23 @@
 import hashlib
 import os
+import tempfile
 import requests
 from flask import current_app, request
 from werkzeug.utils import secure_filename
 from app.models import Installer, InstallerSwitch, NestedInstallerFile, Setting
 from app.constants import installer_switches
-import boto3
-s3_client = boto3.client('s3')
-URL_EXPIRATION_SECONDS = 3600
+from app.settings import get_setting
+from app.s3 import presigned_urls
+from app.blob_store import blob_store
+
+try:
+    from gevent import get_hub
+    from gevent.monkey import is_module_patched
+except ImportError:
+    get_hub = None
+
 basedir = os.path.abspath(os.path.dirname(__file__))
+UPLOAD_BUFFER_SIZE = 1024 * 1024
 
 
 def get_file_hash_from_url(url, max_content_length=1024 * 1024 * 1024 * 10):  # Default max content length set to 10GB
@@ -33,38 +42,37 @@ def get_file_hash_from_url(url, max_content_length=1024 * 1024 * 1024 * 10):  #
     return hash_sha256.hexdigest()
 
 
+def s3_upload_key(publisher, identifier, version, architecture, file_name):
+    """S3 key an installer is uploaded to with a presigned URL, before it's moved into the blob store."""
+    parts = [secure_filename(part) for part in (publisher, identifier, version, architecture)]
+    return '/'.join(['packages'] + parts + [file_name])
+
+
 def create_installer(publisher, identifier, version, installer_form):
     file = installer_form.file.data
     external_url = installer_form.url.data
     is_aws = installer_form.is_aws.data
     architecture = installer_form.architecture.data
-    installer_type = installer_form.installer_type.data
     scope = installer_form.installer_scope.data
-    nestedinstallertype = installer_form.nestedinstallertype.data
-    nestedinstallerpath = installer_form.nestedinstallerpath.data
-
 
     # If file is provided, save the file
     if file:
         file_name = secure_filename(file.filename)
         file_name = f'{scope}.' + file_name.rsplit('.', 1)[1]
-        hash = save_file(file, file_name, publisher, identifier, version, architecture)
+        hash = save_file(file)
         if hash is None:
             return "Error saving file", 500
     elif not file and external_url and is_aws:
         current_app.logger.info("Installer is on AWS")
-        file_name = external_url
-        s3_object_key = f'packages/{publisher}/{identifier}/{version}/{architecture}/{file_name}'
+        file_name = f'{scope}.' + secure_filename(external_url).rsplit('.', 1)[1]
+        s3_object_key = s3_upload_key(publisher, identifier, version, architecture, file_name)
         external_url = None
 
         # Generate a pre-signed URL for S3 uploads
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': Setting.get("BUCKET_NAME").get_value(), 'Key': s3_object_key},
-            ExpiresIn=URL_EXPIRATION_SECONDS
-        )
+        presigned_url = presigned_urls.get_object_url(get_setting("BUCKET_NAME"), s3_object_key)
         current_app.logger.info(f"Getting file hash from presigned URL: {presigned_url}")
         hash = get_file_hash_from_url(presigned_url)
+        blob_store.add_s3_object(s3_object_key, hash)
     # If no file is provided, but an external_url is available, use that
     elif external_url:
         current_app.logger.info("Getting file hash from external URL")
@@ -75,14 +83,29 @@ def create_installer(publisher, identifier, version, installer_form):
     else:
         current_app.logger.error("No file or external URL provided")
         raise ValueError("Either a file or an external URL must be provided.")
-    
+
+    return build_installer(installer_form, file_name, external_url, hash)
+
+
+def build_installer(installer_form, file_name, external_url, hash):
+    """Create an installer from the form fields for a file that's already stored or hashed."""
+    architecture = installer_form.architecture.data
+    installer_type = installer_form.installer_type.data
+    scope = installer_form.installer_scope.data
+    nestedinstallertype = installer_form.nestedinstallertype.data
+    nestedinstallerpath = installer_form.nestedinstallerpath.data
+    product_code = installer_form.product_code.data or None
+    package_family_name = installer_form.package_family_name.data or None
+
     installer = Installer(
         architecture=architecture,
         installer_type=installer_type,
         file_name=file_name,
         external_url=external_url,
         installer_sha256=hash,
-        scope=scope
+        scope=scope,
+        product_code=product_code,
+        package_family_name=package_family_name
     )
 
     for field_name in installer_switches:
@@ -104,51 +127,44 @@ def create_installer(publisher, identifier, version, installer_form):
 
     return installer
 
-def calculate_sha256(filename):
+def run_blocking(func, *args):
+    """Run func in gevent's thread pool when the worker is a gevent one.
+
+    Disk I/O and hashing don't yield to other greenlets, a large upload would
+    hold up every download of the worker until it's written.
+    """
+    if get_hub is not None and is_module_patched('threading'):
+        return get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+
+def write_with_sha256(stream, file_path):
+    """Copy stream to file_path and return the SHA256 of the data, reading it only once."""
     sha256_hash = hashlib.sha256()
 
-    with open(filename, 'rb') as file:
-        # Read the file in chunks to efficiently handle large files
-        for chunk in iter(lambda: file.read(4096), b''):
+    with open(file_path, 'wb') as file:
+        for chunk in iter(lambda: stream.read(UPLOAD_BUFFER_SIZE), b''):
             sha256_hash.update(chunk)
+            file.write(chunk)
+        # The file is renamed into place next, make sure its content is on disk first
+        file.flush()
+        os.fsync(file.fileno())
 
     return sha256_hash.hexdigest()
 
 
-def delete_installer_util(package, installer, version):
-    if not installer.external_url and installer.file_name:
-        base_path = ['packages', package.publisher, package.identifier, version.version_code, installer.architecture]
-        if Setting.get("USE_S3").get_value():
-            s3_key = '/'.join(base_path + [installer.file_name])
-            current_app.logger.info(f"Deleting file from S3: {s3_key}")
-            s3_client.delete_object(
-                Bucket=Setting.get("BUCKET_NAME").get_value(),
-                Key=s3_key
-            )
-        else:
-            # Construct the file system path
-            installer_path = os.path.join(basedir, *base_path, installer.file_name)
-            if os.path.exists(installer_path):
-                current_app.logger.info(f"Deleting file from local file system: {installer_path}")
-                os.remove(installer_path)
-
-
-def save_file(file, file_name, publisher, identifier, version, architecture):
-    publisher = secure_filename(publisher)
-    identifier = secure_filename(identifier)
-    version = secure_filename(version)
-    architecture = secure_filename(architecture)
-
-
-    # Create directory if it doesn't exist
-    save_directory = os.path.join(basedir, 'packages', publisher, identifier, version, architecture)
-    if not os.path.exists(save_directory):
-        os.makedirs(save_directory)
-
-    # Save file locally
-    file_path = os.path.join(save_directory, file_name)
-    file.save(file_path)
-
-    # Get file hash
-    hash = calculate_sha256(file_path)
-    return hash
\ No newline at end of file
+def save_file(file):
+    """Store an uploaded installer in the blob store and return its SHA256."""
+    os.makedirs(blob_store.directory, exist_ok=True)
+    fd, file_path = tempfile.mkstemp(dir=blob_store.directory, prefix='.upload-')
+    os.close(fd)
+    try:
+        hash = run_blocking(write_with_sha256, file.stream, file_path)
+        # mkstemp creates the file private, the reverse proxy may serve it directly
+        os.chmod(file_path, 0o644)
+        blob_store.add_file(file_path, hash)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    return hash
@@ -1,11 +1,20 @@
 
+import base64
+import binascii
 import os
-from flask import Blueprint, jsonify, render_template, request, redirect, url_for, current_app, send_from_directory, flash
+from urllib.parse import quote
+from flask import Blueprint, abort, jsonify, render_template, request, redirect, url_for, current_app, send_from_directory, flash
 from flask_login import login_required
 from sqlalchemy import and_, or_
 from werkzeug.http import parse_range_header
 from werkzeug.utils import secure_filename
 
+from app.cache import manifest_cache
+from app.compression import PrecompressedBody, compress_response, matching_etag
+from app.preindexed import preindexed_directory
+from app.search import match_exact, search_index
+from app.settings import get_setting
+from app.uplink import uplink
 from app.utils import create_installer, save_file, basedir
 from app import db, settings
 from app.models import InstallerSwitch, Package, PackageVersion, Installer, Setting, User
@@ -13,20 +22,98 @@ from app.models import InstallerSwitch, Package, PackageVersion, Installer, Sett
 
 winget = Blueprint('winget', __name__)
 
+DEFAULT_MAXIMUM_RESULTS = 50
+# Upper bound for MaximumResults, a page is rendered in full for every request
+MAXIMUM_RESULTS_LIMIT = 1000
+winget.after_request(compress_response)
+
 @winget.route('/')
 def index():
     return "WinGet API is running, see documentation for more information", 200
 
+def not_modified(etag):
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def uplink_response(upstream):
+    """Turn an UplinkResponse into a response, or the usual empty one if the uplink had nothing."""
+    if upstream is None or upstream.status == 204:
+        return jsonify({}), 204
+    matched = matching_etag(upstream.etag)
+    if matched:
+        return not_modified(matched)
+    response = current_app.response_class(upstream.body, mimetype="application/json")
+    response.set_etag(upstream.etag)
+    return response
+
+
+def encode_continuation_token(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+
+def parse_maximum_results(value):
+    """MaximumResults of a manifestSearch, the default when it's missing or not a positive number."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_MAXIMUM_RESULTS
+    if value <= 0:
+        return DEFAULT_MAXIMUM_RESULTS
+    return min(value, MAXIMUM_RESULTS_LIMIT)
+
+
+def decode_continuation_token(token):
+    """Return the package id a ContinuationToken continues after, or None if it isn't valid."""
+    if not isinstance(token, str):
+        return None
+    try:
+        return int(base64.urlsafe_b64decode(token.encode()).decode())
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+
 @winget.route('/information')
 def information():
-    return jsonify({"Data": {"SourceIdentifier": Setting.get("REPO_NAME").get_value(), "ServerSupportedVersions": ["1.4.0", "1.5.0"]}})
+    response = jsonify({"Data": {"SourceIdentifier": get_setting("REPO_NAME"), "ServerSupportedVersions": ["1.4.0", "1.5.0"]}})
+    response.add_etag()
+    matched = matching_etag(response.get_etag()[0])
+    if matched:
+        return not_modified(matched)
+    return response
     
+@winget.route('/source/<path:filename>')
+def preindexed_source(filename):
+    # Pre-indexed source (Microsoft.PreIndexed.Package), winget downloads the index once and searches locally.
+    # It's built by `flask preindexed build` or in the background, see start_preindexed_job
+    if any(part.startswith('.') for part in filename.split('/')):
+        abort(404)
+    return send_from_directory(preindexed_directory(), filename)
+
 @winget.route('/packageManifests/<name>', methods=['GET'])
 def get_package_manifest(name):
-    package = Package.query.filter_by(identifier=name).first()
-    if package is None:
-        return jsonify({}), 204
-    return jsonify(package.generate_output())
+    # Installer URLs are absolute so the host is part of the cache key
+    cache_key = (request.host_url, name)
+    cached = manifest_cache.get(cache_key)
+    if cached is None:
+        package = Package.query.filter_by(identifier=name).first()
+        if package is None:
+            return uplink_response(uplink.get(f"/packageManifests/{quote(name, safe='')}"))
+        etag = package.manifest_etag(request.host_url)
+        # Answer revalidations before rendering the whole manifest
+        matched = matching_etag(etag)
+        if matched:
+            return not_modified(matched)
+        package = Package.load_manifests([package])[0]
+        body = current_app.json.dumps_bytes(package.generate_output())
+        cached = PrecompressedBody(body, etag)
+        manifest_cache.set(cache_key, cached)
+
+    matched = matching_etag(cached.etag)
+    if matched:
+        return not_modified(matched)
+    return cached.make_response()
 
 
 
@@ -35,10 +122,21 @@ def manifest_search():
     request_data = request.get_json()
     current_app.logger.info(f"Received manifestSearch request: {request_data}")
 
-    maximum_results = request_data.get('MaximumResults', 50)
+    maximum_results = parse_maximum_results(request_data.get('MaximumResults'))
+
+    # Initialize the base query, ordered by id so pages can continue after the last id of the previous one
+    packages_query = Package.query.order_by(Package.id)
 
-    # Initialize the base query
-    packages_query = Package.query
+    continuation_token = request_data.get('ContinuationToken')
+    if continuation_token:
+        last_id = decode_continuation_token(continuation_token)
+        if last_id is None:
+            if uplink.base_url():
+                # Not one of ours, so it belongs to a page the uplink returned
+                return uplink_response(uplink.post("/manifestSearch", current_app.json.dumps_bytes(request_data)))
+            current_app.logger.warning(f"Invalid ContinuationToken: {continuation_token}")
+            return "Invalid ContinuationToken", 400
+        packages_query = packages_query.filter(Package.id > last_id)
 
     # Process Filters and Inclusions
     combined_filters = request_data.get('Filters', []) + request_data.get('Inclusions', [])
@@ -50,16 +148,23 @@ def manifest_search():
         keyword = main_query.get('KeyWord')
         match_type = main_query.get('MatchType')
         if match_type == 'Exact':
-            filter_conditions.append(or_(Package.name == keyword, Package.identifier == keyword))
+            filter_conditions.append(or_(*(match_exact(field, [keyword]) for field in ['name', 'identifier', 'moniker'])))
+        elif keyword:
+            filter_conditions.append(search_index.match(keyword, ['name', 'identifier', 'moniker', 'tags']))
 
 
+    # winget upgrade sends one exact Inclusion per installed app, collect those per field
+    # so they can be resolved with a single IN-list per field instead of one OR'ed predicate each
+    exact_keywords = {}
+
     for filter_entry in combined_filters:
         field = {
-            'PackageName': Package.name,
-            'PackageIdentifier': Package.identifier,
-            'PackageFamilyName': Package.identifier,  # Update these mappings based on your schema
-            'ProductCode': Package.name,       # Update these mappings based on your schema
-            'Moniker': Package.name                 # Update these mappings based on your schema
+            'PackageName': 'name',
+            'PackageIdentifier': 'identifier',
+            'PackageFamilyName': 'package_family_name',
+            'ProductCode': 'product_code',
+            'Moniker': 'moniker',
+            'Tag': 'tags',
         }.get(filter_entry.get('PackageMatchField'))
 
         if not field:
@@ -70,13 +175,15 @@ def manifest_search():
         match_type = filter_entry.get('RequestMatch', {}).get('MatchType')
 
         if match_type == 'Exact':
-            filter_conditions.append(field == keyword)
+            exact_keywords.setdefault(field, set()).add(keyword)
         elif match_type in ['Partial', 'Substring', 'CaseInsensitive']:
-            filter_conditions.append(field.ilike(f'%{keyword}%'))
+            filter_conditions.append(search_index.match(keyword, [field]))
         else:
             current_app.logger.warning(f"Invalid match type: {match_type}")
             continue
 
+    for field, keywords in exact_keywords.items():
+        filter_conditions.append(match_exact(field, keywords))
 
 
 
@@ -84,20 +191,39 @@ def manifest_search():
     if filter_conditions:
         packages_query = packages_query.filter(or_(*filter_conditions))
 
-    # Apply limit and execute query
-    packages_query = packages_query.limit(maximum_results)
+    # Only return packages that have at least one installer
+    packages_query = packages_query.filter(
+        Package.versions.any(PackageVersion.installers.any())
+    )
+
+    # Fetch one extra package to know if there is another page
+    packages_query = packages_query.limit(maximum_results + 1)
     packages = packages_query.all()
+    next_token = None
+    if len(packages) > maximum_results:
+        packages = packages[:maximum_results]
+        next_token = encode_continuation_token(packages[-1].id)
+
+    # The result only changes when the request or one of the matched packages does
+    etag = Package.make_etag(request.get_data(), *[(package.id, package.revision) for package in packages])
+    matched = matching_etag(etag)
+    if matched:
+        return not_modified(matched)
 
     # Generate output data
     output_data = [
             package.generate_output_manifest_search()
-            for package in packages
-            if package.versions and any(version.installers for version in package.versions)
+            for package in Package.load_manifests(packages)
         ]
     if not output_data:
         current_app.logger.info("No packages found.")
-        return jsonify({}), 204
+        return uplink_response(uplink.post("/manifestSearch", current_app.json.dumps_bytes(request_data)))
 
     current_app.logger.info(f"Returning {len(output_data)} packages.")
-    current_app.logger.info(f"Output Data: {output_data}")
-    return jsonify({"Data": output_data})
\ No newline at end of file
+    current_app.logger.debug("Output Data: %s", output_data)
+    response_data = {"Data": output_data}
+    if next_token:
+        response_data["ContinuationToken"] = next_token
+    response = jsonify(response_data)
+    response.set_etag(etag)
+    return response
\ No newline at end of file
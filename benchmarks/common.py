@@ -0,0 +1,90 @@
+"""Shared setup for the benchmarks that need the app, run them from the repository root."""
+import os
+import sys
+import tempfile
+import time
+
+# The configuration is read from the environment once, when it's first used
+os.environ.setdefault("WINGETTY_SQLALCHEMY_DATABASE_URI", f"sqlite:///{tempfile.mkdtemp()}/wingetty.db")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from sqlalchemy import insert  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.models import Installer, InstallerSwitch, Package, PackageVersion  # noqa: E402
+
+
+def create_benchmark_app():
+    """Create the app on an empty database, WINGETTY_SQLALCHEMY_DATABASE_URI picks another one."""
+    # create_app skips creating permissions and settings for `flask db`, the tables don't exist yet
+    argv = sys.argv
+    sys.argv = ["flask", "db"]
+    try:
+        app = create_app()
+    finally:
+        sys.argv = argv
+    with app.app_context():
+        db.create_all()
+        from app.permissions import create_all as create_permissions
+        from app.settings import create_all as create_settings
+
+        create_permissions()
+        create_settings()
+    return app
+
+
+def add_packages(app, count, versions=1):
+    """Insert packages Pub.App0..count with versions 1.0.0..versions, each with an installer whose ProductCode
+    is {package-version}. Bulk inserted without the search index, only exact matches find them."""
+    with app.app_context():
+        db.session.execute(
+            insert(Package),
+            [{"id": number + 1, "identifier": f"Pub.App{number}", "name": f"App {number}", "publisher": "Pub"}
+             for number in range(count)],
+        )
+        db.session.execute(
+            insert(PackageVersion),
+            [
+                {
+                    "id": number * versions + version + 1,
+                    "identifier": f"Pub.App{number}",
+                    "version_code": f"1.{version}.0",
+                    "package_locale": "en-US",
+                    "short_description": "App",
+                }
+                for number in range(count)
+                for version in range(versions)
+            ],
+        )
+        db.session.execute(
+            insert(Installer),
+            [
+                {
+                    "id": id,
+                    "version_id": id,
+                    "architecture": "x64",
+                    "installer_type": "exe",
+                    "file_name": "machine.exe",
+                    "installer_sha256": "ab" * 32,
+                    "scope": "machine",
+                    "product_code": f"{{{(id - 1) // versions}-{(id - 1) % versions}}}",
+                }
+                for id in range(1, count * versions + 1)
+            ],
+        )
+        db.session.execute(
+            insert(InstallerSwitch),
+            [{"installer_id": id, "parameter": "Silent", "value": "/S"} for id in range(1, count * versions + 1)],
+        )
+        db.session.commit()
+
+
+def measure(name, run, rounds):
+    """Run run rounds times and print the time per round."""
+    run()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        run()
+    elapsed = (time.perf_counter() - started) / rounds
+    print(f"{name}: {elapsed * 1000:.2f} ms")
+    return elapsed
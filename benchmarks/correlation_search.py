@@ -0,0 +1,52 @@
+"""manifestSearch for a winget upgrade sweep: 200 exact ProductCode Inclusions against 10k packages.
+
+Run with `python -m benchmarks.correlation_search`. Prints the time of the
+whole request and of the package lookup on its own, both as one IN-list and
+as one OR'ed condition per inclusion, the way the lookup used to be built.
+"""
+from sqlalchemy import or_
+
+from app.models import Package
+from app.search import match_exact
+from benchmarks.common import add_packages, create_benchmark_app, measure
+
+PACKAGES = 10000
+INCLUSIONS = 200
+ROUNDS = 20
+
+
+def main():
+    app = create_benchmark_app()
+    add_packages(app, PACKAGES)
+    client = app.test_client()
+    # Spread over the catalog, a tenth of them unknown to the repository
+    keywords = [f"{{{number * (PACKAGES // INCLUSIONS)}-0}}" for number in range(INCLUSIONS * 9 // 10)]
+    keywords += [f"{{unknown-{number}}}" for number in range(INCLUSIONS - len(keywords))]
+    body = {
+        "Inclusions": [
+            {"PackageMatchField": "ProductCode", "RequestMatch": {"KeyWord": keyword, "MatchType": "Exact"}}
+            for keyword in keywords
+        ],
+        "MaximumResults": 1000,
+    }
+
+    def search():
+        response = client.post("/wg/manifestSearch", json=body)
+        assert len(response.json["Data"]) == INCLUSIONS * 9 // 10
+
+    with app.app_context():
+        measure(f"manifestSearch, {INCLUSIONS} inclusions, {PACKAGES} packages", search, ROUNDS)
+        measure(
+            "lookup, one IN-list",
+            lambda: Package.query.filter(match_exact("product_code", keywords)).all(),
+            ROUNDS,
+        )
+        measure(
+            "lookup, one condition per inclusion",
+            lambda: Package.query.filter(or_(*(match_exact("product_code", [keyword]) for keyword in keywords))).all(),
+            ROUNDS,
+        )
+
+
+if __name__ == "__main__":
+    main()
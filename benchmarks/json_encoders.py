@@ -0,0 +1,30 @@
+"""Encoding a 50 version packageManifests response with the stdlib encoder and with FastJSONProvider.
+
+Run with `python -m benchmarks.json_encoders`, orjson is only used when it's installed.
+"""
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import json_provider
+from app.models import Package
+from benchmarks.common import add_packages, create_benchmark_app, measure
+
+VERSIONS = 50
+ROUNDS = 2000
+
+
+def main():
+    app = create_benchmark_app()
+    add_packages(app, 1, versions=VERSIONS)
+    with app.test_request_context():
+        manifest = Package.load_manifests(Package.query.all())[0].generate_output()
+        stdlib = DefaultJSONProvider(app)
+        print(f"{len(app.json.dumps_bytes(manifest))} bytes, orjson {'installed' if json_provider.orjson else 'not installed'}")
+        measure("flask stdlib provider", lambda: stdlib.dumps(manifest).encode(), ROUNDS)
+        measure("json.dumps, compact", lambda: json.dumps(manifest, separators=(",", ":")).encode(), ROUNDS)
+        measure("FastJSONProvider.dumps_bytes", lambda: app.json.dumps_bytes(manifest), ROUNDS)
+
+
+if __name__ == "__main__":
+    main()
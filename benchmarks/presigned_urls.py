@@ -0,0 +1,34 @@
+"""Cost of signing an S3 download URL against getting it from PresignedURLCache.
+
+Run with `python -m benchmarks.presigned_urls`, signing happens locally so no
+bucket or real credentials are needed.
+"""
+import timeit
+
+import boto3
+
+from app.s3 import PresignedURLCache
+
+ROUNDS = 5000
+
+
+def main():
+    client = boto3.client("s3", aws_access_key_id="test", aws_secret_access_key="test", region_name="us-east-1")
+    cache = PresignedURLCache(client)
+    keys = [f"blobs/{number:02x}/{number:064x}" for number in range(100)]
+
+    def sign():
+        for key in keys:
+            client.generate_presigned_url("get_object", Params={"Bucket": "bucket", "Key": key}, ExpiresIn=3600)
+
+    def cached():
+        for key in keys:
+            cache.get_object_url("bucket", key)
+
+    for name, run in (("sign", sign), ("cache", cached)):
+        seconds = min(timeit.repeat(run, number=ROUNDS // len(keys), repeat=3))
+        print(f"{name:>6}: {seconds / ROUNDS * 1e6:8.1f} us per URL")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Throughput of local installer downloads with many concurrent clients resuming in ranges, like winget does.
+
+Run with `python -m benchmarks.ranged_downloads`. Serves the app with one
+gunicorn gevent worker, the way start.sh does, so wsgi.file_wrapper can use
+sendfile. Prints the throughput and the CPU time the worker used per GB.
+"""
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app import db
+from app.models import Installer
+from benchmarks.common import add_packages, create_benchmark_app
+
+SIZE = 64 * 1024 ** 2
+RANGE_SIZE = 4 * 1024 ** 2
+CLIENTS = 32
+DOWNLOADS = 64
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cpu_seconds(pid):
+    """User and system CPU time of pid and its children, None where /proc isn't available."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as file:
+            pids = [pid] + [int(child) for child in file.read().split()]
+        total = 0
+        for process in pids:
+            with open(f"/proc/{process}/stat") as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        return total / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return None
+
+
+def download(session, url):
+    """Download url in RANGE_SIZE parts and return the number of bytes received."""
+    received = 0
+    etag = None
+    while received < SIZE:
+        headers = {"Range": f"bytes={received}-{received + RANGE_SIZE - 1}"}
+        if etag:
+            headers["If-Range"] = etag
+        response = session.get(url, headers=headers)
+        assert response.status_code == 206, response.status_code
+        etag = response.headers["ETag"]
+        received += len(response.content)
+    return received
+
+
+def main():
+    app = create_benchmark_app()
+    # Imports app.settings, which has to happen after create_app (see tests/conftest.py)
+    from app.blob_store import blob_store
+
+    add_packages(app, 1)
+    data = os.urandom(SIZE)
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = blob_store.path(sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+    with app.app_context():
+        Installer.query.one().installer_sha256 = sha256
+        db.session.commit()
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}", "-w", "1", "-k", "gevent",
+         "--log-level", "warning", "app:create_app()"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/api/download/Pub.App0/1.0.0/x64/machine"
+    try:
+        for _ in range(100):
+            try:
+                requests.head(url, timeout=5)
+                break
+            except requests.RequestException:
+                time.sleep(0.1)
+
+        cpu_before = cpu_seconds(server.pid)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(CLIENTS) as pool:
+            sessions = [requests.Session() for _ in range(DOWNLOADS)]
+            received = sum(pool.map(download, sessions, [url] * DOWNLOADS))
+        elapsed = time.perf_counter() - started
+        cpu_after = cpu_seconds(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+        os.remove(path)
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+    gigabytes = received / 1024 ** 3
+    print(f"{DOWNLOADS} downloads of {SIZE // 1024 ** 2} MB in {RANGE_SIZE // 1024 ** 2} MB ranges, {CLIENTS} at a time")
+    print(f"{gigabytes / elapsed * 1024:.0f} MB/s")
+    if cpu_before is not None:
+        print(f"worker CPU: {(cpu_after - cpu_before) / gigabytes:.2f} s per GB")
+
+
+if __name__ == "__main__":
+    main()
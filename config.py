@@ -5,7 +5,56 @@ settings = Dynaconf(
     envvar_prefix="WINGETTY",
     settings_files=['settings.toml', '.secrets.toml'],
     VERSION = "1.0.0",
-    PREFERRED_URL_SCHEME = "https"
+    PREFERRED_URL_SCHEME = "https",
+    # Number of rendered package manifests kept in memory per worker (0 disables the cache)
+    MANIFEST_CACHE_SIZE = 512,
+    # How often (in seconds) a worker checks whether another worker invalidated its caches
+    CACHE_CHECK_INTERVAL = 5,
+    # Package search backend: "ngram", "pg_trgm" or "like", picked from the database type when empty
+    SEARCH_BACKEND = "",
+    # winget responses smaller than this many bytes are sent uncompressed
+    COMPRESSION_MIN_SIZE = 1024,
+    # Keep a static copy of the winget API in this directory (see `flask mirror export`), disabled when empty
+    MIRROR_DIR = "",
+    # External URL of WinGetty used for installer URLs in the mirror, e.g. https://wingetty.example.com/
+    MIRROR_BASE_URL = "",
+    # Seconds between mirror updates
+    MIRROR_INTERVAL = 60,
+    # Where the pre-indexed source (served under /wg/source/) is built, defaults to instance/preindexed
+    PREINDEXED_DIR = "",
+    # Seconds between checks whether the pre-indexed source has to be rebuilt, it's only built when MIRROR_BASE_URL is set
+    PREINDEXED_INTERVAL = 60,
+    # Seconds manifests dropped from the pre-indexed source are kept, a signed source.msix may still point to them
+    PREINDEXED_RETENTION = 7 * 24 * 3600,
+    # Seconds an uplink response is served from cache, and how long after that it's still served while being refreshed
+    UPLINK_CACHE_TTL = 300,
+    UPLINK_STALE_TTL = 3600,
+    # Number of uplink responses kept in memory per worker
+    UPLINK_CACHE_SIZE = 1024,
+    # Seconds to wait for the uplink before giving up
+    UPLINK_TIMEOUT = 10,
+    # Cache installers with an external URL in this directory on first download, disabled when empty
+    INSTALLER_CACHE_DIR = "",
+    # Maximum size of the installer cache in bytes, least recently downloaded installers are removed first
+    INSTALLER_CACHE_MAX_SIZE = 10 * 1024 ** 3,
+    # Seconds to wait for the external host before redirecting the client to it instead
+    INSTALLER_CACHE_TIMEOUT = 30,
+    # Seconds between writes of the download counters to the database
+    DOWNLOAD_FLUSH_INTERVAL = 10,
+    # Download stats are kept per minute for this many hours and per hour for this many days, then rolled up
+    DOWNLOAD_STATS_MINUTE_RETENTION = 24,
+    DOWNLOAD_STATS_HOUR_RETENTION = 30,
+    # Seconds between roll ups of the download stats
+    DOWNLOAD_STATS_COMPACT_INTERVAL = 600,
+    # Let the reverse proxy send local installers: "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd), disabled when empty
+    DOWNLOAD_OFFLOAD = "",
+    # Internal nginx location that maps to the packages directory, used with x-accel-redirect
+    DOWNLOAD_OFFLOAD_PREFIX = "/internal-packages/",
+    # Number of reverse proxies in front of WinGetty whose X-Forwarded-For/Proto/Host headers are trusted
+    PROXY_COUNT = 0,
+    # Seconds presigned S3 download URLs are valid for, they're reused until this many seconds before they expire
+    S3_URL_EXPIRATION = 3600,
+    S3_URL_EXPIRATION_MARGIN = 300
 )
 
 # `envvar_prefix` = export envvars with `export DYNACONF_FOO=bar`.
@@ -0,0 +1,30 @@
+"""Never reuse package ids
+
+Revision ID: 4c8e1a7f3b92
+Revises: e6b2c9d4f803
+Create Date: 2026-10-17 09:12:41.275390
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8e1a7f3b92'
+down_revision = 'e6b2c9d4f803'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Only SQLite hands out the id of a deleted row again, AUTOINCREMENT stops that
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('package', recreate='always', table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('package', recreate='always') as batch_op:
+        pass
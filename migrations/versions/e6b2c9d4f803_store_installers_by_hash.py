@@ -0,0 +1,221 @@
+"""Store installers by hash
+
+Revision ID: e6b2c9d4f803
+Revises: d3f7a9b2c184
+Create Date: 2026-10-16 23:52:14.630118
+
+"""
+import hashlib
+import logging
+import os
+import shutil
+
+from alembic import op
+import boto3
+import sqlalchemy as sa
+from botocore.exceptions import ClientError
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b2c9d4f803'
+down_revision = 'd3f7a9b2c184'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+# The migration keeps its own copy of the storage layout and settings lookup,
+# the app's may change after it was written
+CHUNK_SIZE = 1024 * 1024
+
+
+def packages_directory():
+    return os.path.join(current_app.root_path, 'packages')
+
+
+def blob_key(sha256):
+    return f'blobs/{sha256[:2]}/{sha256}'
+
+
+def blob_path(sha256):
+    return os.path.join(packages_directory(), 'blobs', sha256[:2], sha256)
+
+
+def setting(key):
+    """Value of a setting, overridden by the config like Setting.get_value does."""
+    for config_key, value in current_app.config.items():
+        if config_key.upper() == key.upper():
+            return value
+    return op.get_bind().execute(sa.text('SELECT value FROM setting WHERE key = :key'), {'key': key}).scalar()
+
+
+def storage():
+    """The S3 client and bucket if installers are stored on S3, otherwise (None, None)."""
+    use_s3 = setting('use_s3')
+    if isinstance(use_s3, str):
+        use_s3 = use_s3.lower() == 'true'
+    if not use_s3:
+        return None, None
+    return boto3.client('s3'), setting('bucket_name')
+
+
+def stored_installers():
+    return op.get_bind().execute(sa.text(
+        "SELECT installer.id, package.publisher, package.identifier, package_version.version_code, "
+        "installer.architecture, installer.file_name, installer.installer_sha256 "
+        "FROM installer "
+        "JOIN package_version ON package_version.id = installer.version_id "
+        "JOIN package ON package.identifier = package_version.identifier "
+        "WHERE installer.external_url IS NULL AND installer.file_name IS NOT NULL"
+    )).fetchall()
+
+
+def legacy_paths(row):
+    """Paths relative to the packages directory the installer may have been saved at."""
+    parts = [row.publisher, row.identifier, row.version_code, row.architecture]
+    # save_file and S3 uploads used safe file names, older S3 keys the values as is
+    paths = ['/'.join([secure_filename(part) for part in parts] + [row.file_name])]
+    raw_path = '/'.join(parts + [row.file_name])
+    if raw_path not in paths:
+        paths.append(raw_path)
+    return paths
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def s3_sha256(s3_client, bucket, key):
+    """SHA256 of the object, None if it doesn't exist."""
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    except ClientError:
+        return None
+    sha256 = hashlib.sha256()
+    for chunk in body.iter_chunks(CHUNK_SIZE):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def s3_exists(s3_client, bucket, key):
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError:
+        return False
+    return True
+
+
+def correct_sha256(row, relative_path, actual):
+    """Point the installer at the hash its file actually has, the blob is stored under that one."""
+    logger.warning(
+        f"File {relative_path} of {row.identifier} {row.version_code} has SHA256 {actual}, "
+        f"expected {row.installer_sha256}, updating the installer's SHA256"
+    )
+    op.get_bind().execute(
+        sa.text('UPDATE installer SET installer_sha256 = :sha256 WHERE id = :id'), {'sha256': actual, 'id': row.id}
+    )
+
+
+def move_to_blobs(rows):
+    s3_client, bucket = storage()
+    directory = packages_directory()
+    stored = set()
+    for row in rows:
+        expected = (row.installer_sha256 or '').lower()
+        found = False
+        for relative_path in legacy_paths(row):
+            # Hashed while moving, the blob has to be stored under the hash of its content.
+            # Only the first path that exists is used, the others are older copies at most
+            if s3_client:
+                key = 'packages/' + relative_path
+                sha256 = s3_sha256(s3_client, bucket, key)
+                if sha256 is None:
+                    continue
+                if sha256 not in stored:
+                    s3_client.copy({'Bucket': bucket, 'Key': key}, bucket, blob_key(sha256))
+                s3_client.delete_object(Bucket=bucket, Key=key)
+            else:
+                path = os.path.join(directory, *relative_path.split('/'))
+                if not os.path.isfile(path):
+                    continue
+                sha256 = file_sha256(path)
+                target = blob_path(sha256)
+                if os.path.exists(target):
+                    # Same file as another installer's, it's only kept once
+                    os.remove(path)
+                else:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(path, target)
+            stored.add(sha256)
+            found = True
+            if sha256 != expected:
+                correct_sha256(row, relative_path, sha256)
+            break
+        if not found and expected not in stored:
+            logger.warning(f"File of installer {row.file_name} of {row.identifier} {row.version_code} not found")
+
+    if not s3_client and os.path.isdir(directory):
+        # Remove the directories the files were moved out of
+        blobs_directory = os.path.join(directory, 'blobs')
+        for subdirectory, _, _ in os.walk(directory, topdown=False):
+            if subdirectory in (directory, blobs_directory) or subdirectory.startswith(blobs_directory + os.sep):
+                continue
+            try:
+                os.rmdir(subdirectory)
+            except OSError:
+                pass
+
+
+def restore_from_blobs(rows):
+    s3_client, bucket = storage()
+    directory = packages_directory()
+    sha256s = set()
+    for row in rows:
+        if not row.installer_sha256:
+            continue
+        sha256 = row.installer_sha256.lower()
+        relative_path = legacy_paths(row)[0]
+        if s3_client:
+            if s3_exists(s3_client, bucket, blob_key(sha256)):
+                s3_client.copy({'Bucket': bucket, 'Key': blob_key(sha256)}, bucket, 'packages/' + relative_path)
+        elif os.path.exists(blob_path(sha256)):
+            path = os.path.join(directory, *relative_path.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(blob_path(sha256), path)
+        sha256s.add(sha256)
+
+    if s3_client:
+        for sha256 in sha256s:
+            s3_client.delete_object(Bucket=bucket, Key=blob_key(sha256))
+    else:
+        shutil.rmtree(os.path.join(directory, 'blobs'), ignore_errors=True)
+
+
+def upgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('blob',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.PrimaryKeyConstraint('sha256', name=op.f('pk_blob'))
+    )
+    with op.batch_alter_table('installer', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_installer_installer_sha256'), ['installer_sha256'], unique=False)
+
+    # ### end Alembic commands ###
+    move_to_blobs(stored_installers())
+
+
+def downgrade():
+    restore_from_blobs(stored_installers())
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('installer', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_installer_installer_sha256'))
+
+    op.drop_table('blob')
+
+    # ### end Alembic commands ###
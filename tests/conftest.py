@@ -0,0 +1,127 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+# The configuration is read from the environment once, when it's first used
+os.environ.setdefault("WINGETTY_SQLALCHEMY_DATABASE_URI", f"sqlite:///{tempfile.mkdtemp()}/wingetty.db")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from app import create_app, db  # noqa: E402
+from app.models import Installer, InstallerSwitch, Package, PackageVersion  # noqa: E402
+
+
+def create_test_app():
+    # create_app skips creating permissions and settings for `flask db`, the tables don't exist yet
+    argv = sys.argv
+    sys.argv = ["flask", "db"]
+    try:
+        app = create_app()
+    finally:
+        sys.argv = argv
+    app.config["WTF_CSRF_ENABLED"] = False
+    return app
+
+
+# Created before the test modules are imported: once app.settings is imported,
+# it shadows the config settings create_app loads in the app package
+test_app = create_test_app()
+
+
+@pytest.fixture(scope="session")
+def app():
+    return test_app
+
+
+@pytest.fixture(autouse=True)
+def database(app):
+    """Fresh tables and empty per-worker caches for every test."""
+    from app.cache import download_cache, manifest_cache
+    from app.permissions import create_all as create_permissions
+    from app.s3 import presigned_urls
+    from app.settings import create_all as create_settings, settings_cache
+    from app.uplink import uplink
+
+    for cache in (manifest_cache, download_cache, settings_cache, presigned_urls, uplink):
+        cache.clear()
+    app.extensions.pop("config_cache", None)
+    with app.app_context():
+        db.create_all()
+        create_permissions()
+        create_settings()
+    yield
+    from app.download_counter import download_counter
+
+    # Downloads of the test are counted before its tables are gone
+    download_counter.flush()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def add_packages(app):
+    """Add packages Pub.App0..n with versions 1.0.0..m, each with one installer, and return their identifiers."""
+
+    def add_packages(count, versions=1, start=0):
+        from app.search import search_index
+
+        identifiers = []
+        with app.app_context():
+            for number in range(start, start + count):
+                package = Package(identifier=f"Pub.App{number}", name=f"App {number}", publisher="Pub")
+                for version_number in range(versions):
+                    version = PackageVersion(
+                        version_code=f"1.{version_number}.0",
+                        package_locale="en-US",
+                        short_description="App",
+                        identifier=package.identifier,
+                    )
+                    installer = Installer(
+                        architecture="x64",
+                        installer_type="exe",
+                        file_name="machine.exe",
+                        installer_sha256="ab" * 32,
+                        scope="machine",
+                        product_code=f"{{{number}-{version_number}}}",
+                    )
+                    installer.switches.append(InstallerSwitch(parameter="Silent", value="/S"))
+                    version.installers.append(installer)
+                    package.versions.append(version)
+                search_index.update(package)
+                db.session.add(package)
+                identifiers.append(package.identifier)
+            db.session.commit()
+        return identifiers
+
+    return add_packages
+
+
+@pytest.fixture
+def count_statements(app):
+    """Context manager factory that counts the SQL statements run inside it."""
+
+    class Counter:
+        def __init__(self):
+            self.count = 0
+
+        def __enter__(self):
+            with app.app_context():
+                self.engine = db.engine
+            event.listen(self.engine, "before_cursor_execute", self.increment)
+            return self
+
+        def __exit__(self, *exc_info):
+            event.remove(self.engine, "before_cursor_execute", self.increment)
+
+        def increment(self, *args):
+            self.count += 1
+
+    return Counter
@@ -0,0 +1,70 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from app import db
+from app.download_stats import compact, download_trend, record
+from app.models import DownloadStat
+
+NOW = datetime(2026, 3, 10, 12, 30)
+
+
+def add_downloads(app, minutes_ago, architecture="x64", version_id=1, count=1):
+    with app.app_context():
+        record(
+            Counter(
+                {
+                    (NOW.replace(second=0) - timedelta(minutes=minutes), 1, version_id, version_id, architecture): count
+                    for minutes in minutes_ago
+                }
+            )
+        )
+        db.session.commit()
+
+
+def stats(app):
+    with app.app_context():
+        return sorted((row.period, row.bucket, row.count) for row in DownloadStat.query)
+
+
+def test_compact_rolls_up_old_rows(app):
+    # 2 and 3 days ago, in two different hours each, plus one recent minute
+    old = [2 * 24 * 60, 2 * 24 * 60 + 5, 2 * 24 * 60 + 65, 3 * 24 * 60]
+    add_downloads(app, old + [10], count=2)
+    with app.app_context():
+        assert compact(NOW) == 4
+        assert compact(NOW) == 0
+
+    assert stats(app) == [
+        ("hour", datetime(2026, 3, 7, 12), 2),
+        ("hour", datetime(2026, 3, 8, 11), 2),
+        ("hour", datetime(2026, 3, 8, 12), 4),
+        ("minute", datetime(2026, 3, 10, 12, 20), 2),
+    ]
+
+    with app.app_context():
+        # The recent minute into its hour, then all four hours into their days
+        assert compact(NOW + timedelta(days=40)) == 5
+    assert stats(app) == [
+        ("day", datetime(2026, 3, 7), 2),
+        ("day", datetime(2026, 3, 8), 6),
+        ("day", datetime(2026, 3, 10), 2),
+    ]
+
+
+def test_download_trend_sums_buckets(app):
+    add_downloads(app, [0, 1, 61], architecture="x64")
+    add_downloads(app, [2], architecture="x86", version_id=2, count=3)
+    with app.app_context():
+        compact(NOW + timedelta(days=2))
+        add_downloads(app, [0])
+
+        assert download_trend(1, period="day") == {None: [(datetime(2026, 3, 10), 7)]}
+        assert download_trend(1, period="hour") == {
+            None: [(datetime(2026, 3, 10, 11), 1), (datetime(2026, 3, 10, 12), 6)]
+        }
+        assert download_trend(1, period="hour", group_by="architecture") == {
+            "x64": [(datetime(2026, 3, 10, 11), 1), (datetime(2026, 3, 10, 12), 3)],
+            "x86": [(datetime(2026, 3, 10, 12), 3)],
+        }
+        assert download_trend(1, period="day", version_ids=[2]) == {None: [(datetime(2026, 3, 10), 3)]}
+        assert download_trend(2, period="day") == {}
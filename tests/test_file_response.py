@@ -0,0 +1,112 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from app.blob_store import blob_store
+from app.file_response import FileRange, resolve_ranges
+
+DATA = os.urandom(5000)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+URL = "/api/download/Pub.App0/1.0.0/x64/machine"
+
+
+@pytest.fixture
+def installer(app, add_packages, tmp_path, monkeypatch):
+    from app import db
+    from app.models import Installer
+
+    monkeypatch.setattr(blob_store, "directory", str(tmp_path))
+    path = blob_store.path(SHA256)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as file:
+        file.write(DATA)
+    add_packages(1)
+    with app.app_context():
+        Installer.query.one().installer_sha256 = SHA256
+        db.session.commit()
+
+
+def test_whole_file(client, installer):
+    response = client.get(URL)
+    assert response.status_code == 200
+    assert response.get_data() == DATA
+    assert response.headers["ETag"] == f'"{SHA256}"'
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["Content-Length"] == str(len(DATA))
+    assert response.headers["Content-Disposition"] == "attachment; filename=machine.exe"
+    assert "Last-Modified" in response.headers
+
+
+@pytest.mark.parametrize(
+    "header, start, stop",
+    [("bytes=100-199", 100, 200), ("bytes=-10", 4990, 5000), ("bytes=4990-9999", 4990, 5000), ("bytes=10-", 10, 5000)],
+)
+def test_single_range(client, installer, header, start, stop):
+    response = client.get(URL, headers={"Range": header})
+    assert response.status_code == 206
+    assert response.get_data() == DATA[start:stop]
+    assert response.headers["Content-Range"] == f"bytes {start}-{stop - 1}/5000"
+    assert response.headers["Content-Length"] == str(stop - start)
+
+
+def test_multiple_ranges(client, installer):
+    response = client.get(URL, headers={"Range": "bytes=0-9,20-29"})
+    assert response.status_code == 206
+    assert response.mimetype == "multipart/byteranges"
+    boundary = response.mimetype_params["boundary"].encode()
+    body = response.get_data()
+    assert len(body) == int(response.headers["Content-Length"])
+    parts = body.split(b"--" + boundary)
+    assert parts[0] == b"" and parts[-1] == b"--\r\n"
+    assert parts[1].endswith(b"Content-Range: bytes 0-9/5000\r\n\r\n" + DATA[0:10] + b"\r\n")
+    assert parts[2].endswith(b"Content-Range: bytes 20-29/5000\r\n\r\n" + DATA[20:30] + b"\r\n")
+
+
+def test_unsatisfiable_range(client, installer):
+    response = client.get(URL, headers={"Range": "bytes=6000-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */5000"
+
+
+def test_if_range(client, installer):
+    etag = client.get(URL).headers["ETag"]
+    last_modified = client.get(URL).headers["Last-Modified"]
+    assert client.get(URL, headers={"Range": "bytes=10-", "If-Range": etag}).status_code == 206
+    assert client.get(URL, headers={"Range": "bytes=10-", "If-Range": last_modified}).status_code == 206
+    # The client's part is of another file, it gets the whole new one
+    response = client.get(URL, headers={"Range": "bytes=10-", "If-Range": '"other"'})
+    assert response.status_code == 200
+    assert response.get_data() == DATA
+
+
+def test_conditional_requests(client, installer):
+    response = client.get(URL)
+    assert client.get(URL, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    assert client.get(URL, headers={"If-Modified-Since": response.headers["Last-Modified"]}).status_code == 304
+    assert client.get(URL, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_missing_file(client, installer):
+    os.remove(blob_store.path(SHA256))
+    assert client.get(URL).status_code == 404
+
+
+def test_file_range_only_exposes_descriptor_from_start(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(DATA)
+    whole = FileRange(open(path, "rb"), 0, len(DATA))
+    assert whole.fileno() > 0
+    whole.close()
+
+    part = FileRange(open(path, "rb"), 100, 50)
+    with pytest.raises(io.UnsupportedOperation):
+        part.fileno()
+    assert part.read(30) + part.read() == DATA[100:150]
+    assert part.read() == b""
+    part.close()
+
+
+def test_resolve_ranges():
+    assert resolve_ranges([(0, 10), (-5, None), (90, None), (200, None)], 100) == [(0, 10), (95, 100), (90, 100)]
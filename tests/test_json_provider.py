@@ -0,0 +1,43 @@
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from app import json_provider
+
+VALUE = {
+    "b": [1, 2.5, None, True],
+    "a": {"date": datetime(2026, 3, 10, 12, 30), "id": uuid.UUID(int=1), "price": Decimal("1.50")},
+    "name": "Größe ✓",
+}
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def provider(request, app, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(json_provider, "orjson", None)
+    elif json_provider.orjson is None:
+        pytest.skip("orjson isn't installed")
+    return app.json
+
+
+def test_same_output_as_flask(provider):
+    output = provider.dumps_bytes(VALUE)
+    assert json.loads(output) == {
+        "a": {"date": "Tue, 10 Mar 2026 12:30:00 GMT", "id": str(uuid.UUID(int=1)), "price": "1.50"},
+        "b": [1, 2.5, None, True],
+        "name": "Größe ✓",
+    }
+    assert output.index(b'"a"') < output.index(b'"b"') < output.index(b'"name"')
+    assert b'"b":[1,2.5,null,true]' in output
+    assert provider.dumps(VALUE) == output.decode()
+
+
+def test_response(app, provider):
+    with app.test_request_context():
+        response = provider.response({"Data": [VALUE["a"]]})
+    assert response.mimetype == "application/json"
+    assert response.get_data().endswith(b"}\n")
+    assert json.loads(response.get_data())["Data"][0]["price"] == "1.50"
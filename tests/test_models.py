@@ -0,0 +1,36 @@
+from app import db
+from app.models import Package
+
+
+def render_all(app, count_statements):
+    with app.test_request_context():
+        packages = Package.query.order_by(Package.id).all()
+        with count_statements() as counter:
+            for package in Package.load_manifests(packages):
+                package.generate_output()
+                package.generate_output_manifest_search()
+                package.to_dict()
+        db.session.remove()
+    return counter.count
+
+
+def test_load_manifests_statement_count_is_constant(app, add_packages, count_statements):
+    add_packages(1, versions=1)
+    few = render_all(app, count_statements)
+
+    add_packages(20, versions=10, start=1)
+    many = render_all(app, count_statements)
+
+    assert few == many
+
+
+def test_load_manifests_keeps_order(app, add_packages):
+    add_packages(3)
+    with app.app_context():
+        packages = Package.query.order_by(Package.id.desc()).all()
+        assert [package.identifier for package in Package.load_manifests(packages)] == [
+            "Pub.App2",
+            "Pub.App1",
+            "Pub.App0",
+        ]
+        assert Package.load_manifests([]) == []
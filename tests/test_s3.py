@@ -0,0 +1,90 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import botocore.session
+import pytest
+from botocore.credentials import RefreshableCredentials
+
+from app import s3
+from app.s3 import PresignedURLCache
+
+
+class CountingClient:
+    """Wraps an S3 client and counts the URLs it signs."""
+
+    def __init__(self, client):
+        self.client = client
+        self._request_signer = client._request_signer
+        self.signed = 0
+
+    def generate_presigned_url(self, *args, **kwargs):
+        self.signed += 1
+        return self.client.generate_presigned_url(*args, **kwargs)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(s3.time, "time", lambda: now[0])
+    return now
+
+
+def static_client():
+    return CountingClient(
+        boto3.client("s3", aws_access_key_id="test", aws_secret_access_key="test", region_name="us-east-1")
+    )
+
+
+def temporary_client(expires_in):
+    metadata = {
+        "access_key": "test",
+        "secret_key": "test",
+        "token": "token",
+        "expiry_time": (datetime.now(timezone.utc) + timedelta(seconds=expires_in)).isoformat(),
+    }
+    session = botocore.session.get_session()
+    session._credentials = RefreshableCredentials.create_from_metadata(metadata, lambda: metadata, "test")
+    return CountingClient(session.create_client("s3", region_name="us-east-1"))
+
+
+def test_reuses_url_until_margin(clock):
+    client = static_client()
+    cache = PresignedURLCache(client)
+    cache.expires_in, cache.margin = 3600, 300
+
+    url = cache.get_object_url("bucket", "blobs/ab/abab")
+    assert cache.get_object_url("bucket", "blobs/ab/abab") == url
+    assert cache.get_object_url("bucket", "blobs/cd/cdcd") != url
+    assert cache.get_object_url("bucket", "blobs/ab/abab", ResponseContentDisposition="attachment") != url
+    assert client.signed == 3
+
+    clock[0] += 3600 - 300 - 1
+    assert cache.get_object_url("bucket", "blobs/ab/abab") == url
+    clock[0] += 2
+    cache.get_object_url("bucket", "blobs/ab/abab")
+    assert client.signed == 4
+
+
+def test_url_not_reused_past_credentials_expiry(clock):
+    client = temporary_client(expires_in=1200)
+    cache = PresignedURLCache(client)
+    cache.expires_in, cache.margin = 3600, 300
+
+    url = cache.get_object_url("bucket", "blobs/ab/abab")
+    clock[0] += 1200 - 300 - 10
+    assert cache.get_object_url("bucket", "blobs/ab/abab") == url
+    clock[0] += 20
+    cache.get_object_url("bucket", "blobs/ab/abab")
+    assert client.signed == 2
+
+
+def test_credentials_expiring_within_margin_are_not_cached(clock):
+    client = temporary_client(expires_in=1200)
+    cache = PresignedURLCache(client)
+    cache.expires_in, cache.margin = 3600, 1500
+
+    cache.get_object_url("bucket", "blobs/ab/abab")
+    cache.get_object_url("bucket", "blobs/ab/abab")
+    assert client.signed == 2
+    assert len(cache._urls) == 0
@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app import db
+from app.models import Setting
+from app.settings import settings_cache
+from app.uplink import uplink
+
+
+class Upstream(ThreadingHTTPServer):
+    """Stub winget REST source that counts the requests it gets."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), UpstreamHandler)
+        self.requests = []
+        self.status = 200
+        self.delay = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api"
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.answer()
+
+    def answer(self):
+        self.server.requests.append((self.command, self.path))
+        time.sleep(self.server.delay)
+        body = json.dumps({"Data": {"PackageIdentifier": "Upstream.App", "Request": len(self.server.requests)}}).encode()
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream(app):
+    server = Upstream()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with app.app_context():
+        db.session.get(Setting, "enable_uplink").set_value(True)
+        db.session.get(Setting, "uplink_url").set_value(server.url)
+        db.session.commit()
+        settings_cache.clear()
+    ttl, stale_ttl = uplink.ttl, uplink.stale_ttl
+    yield server
+    uplink.ttl, uplink.stale_ttl = ttl, stale_ttl
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_misses_are_proxied_and_cached(client, upstream):
+    first = client.get("/wg/packageManifests/Upstream.App")
+    assert first.status_code == 200
+    assert first.json["Data"]["PackageIdentifier"] == "Upstream.App"
+    assert first.headers["ETag"]
+
+    second = client.get("/wg/packageManifests/Upstream.App")
+    assert second.get_data() == first.get_data()
+    assert client.get("/wg/packageManifests/Upstream.App", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    search = client.post("/wg/manifestSearch", json={"Query": {"KeyWord": "upstream", "MatchType": "Substring"}})
+    assert search.status_code == 200
+    assert upstream.requests == [("GET", "/api/packageManifests/Upstream.App"), ("POST", "/api/manifestSearch")]
+
+
+def test_local_packages_are_not_proxied(client, upstream, add_packages):
+    add_packages(1)
+    assert client.get("/wg/packageManifests/Pub.App0").json["Data"]["PackageIdentifier"] == "Pub.App0"
+    assert upstream.requests == []
+
+
+def test_stale_responses_are_served_while_refreshing(client, upstream):
+    uplink.ttl, uplink.stale_ttl = 0, 60
+    first = client.get("/wg/packageManifests/Upstream.App")
+    assert client.get("/wg/packageManifests/Upstream.App").get_data() == first.get_data()
+    wait_for(lambda: len(upstream.requests) == 2)
+    wait_for(lambda: client.get("/wg/packageManifests/Upstream.App").json["Data"]["Request"] == 2)
+
+
+def test_concurrent_misses_make_one_upstream_call(app, upstream):
+    upstream.delay = 0.3
+    responses = []
+
+    def fetch():
+        with app.app_context():
+            responses.append(uplink.get("/packageManifests/Upstream.App"))
+
+    threads = [threading.Thread(target=fetch) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(upstream.requests) == 1
+    assert len({response.body for response in responses}) == 1
+
+
+def test_errors_are_not_cached(client, upstream):
+    upstream.status = 500
+    assert client.get("/wg/packageManifests/Upstream.App").status_code == 204
+    upstream.status = 200
+    assert client.get("/wg/packageManifests/Upstream.App").status_code == 200
+    assert len(upstream.requests) == 2
+
+
+def test_disabled_uplink_is_not_called(app, client, upstream):
+    with app.app_context():
+        db.session.get(Setting, "enable_uplink").set_value(False)
+        db.session.commit()
+        settings_cache.clear()
+    assert client.get("/wg/packageManifests/Upstream.App").status_code == 204
+    assert upstream.requests == []
@@ -0,0 +1,58 @@
+import pytest
+
+
+def inclusion(field, keyword):
+    return {"PackageMatchField": field, "RequestMatch": {"KeyWord": keyword, "MatchType": "Exact"}}
+
+
+def upgrade_search(client, inclusions):
+    return client.post("/wg/manifestSearch", json={"Inclusions": inclusions, "MaximumResults": 1000})
+
+
+def test_exact_inclusions_match_each_field(client, add_packages):
+    add_packages(5, versions=2)
+    inclusions = [
+        inclusion("ProductCode", "{1-1}"),
+        inclusion("ProductCode", "{unknown}"),
+        inclusion("PackageIdentifier", "Pub.App3"),
+        inclusion("PackageName", "App 4"),
+    ]
+    response = upgrade_search(client, inclusions)
+    assert response.status_code == 200
+    assert [package["PackageIdentifier"] for package in response.json["Data"]] == ["Pub.App1", "Pub.App3", "Pub.App4"]
+
+
+def test_exact_inclusions_take_a_constant_number_of_statements(client, add_packages, count_statements):
+    add_packages(200)
+
+    with count_statements() as few:
+        response = upgrade_search(client, [inclusion("ProductCode", "{0-0}")])
+    assert len(response.json["Data"]) == 1
+
+    with count_statements() as many:
+        response = upgrade_search(
+            client, [inclusion("ProductCode", f"{{{number}-0}}") for number in range(200)] + [inclusion("ProductCode", "{unknown}")]
+        )
+    assert len(response.json["Data"]) == 200
+    assert few.count == many.count
+
+
+def test_continuation_tokens_page_through_results(client, add_packages):
+    add_packages(5)
+    identifiers = []
+    body = {"MaximumResults": 2}
+    while True:
+        response = client.post("/wg/manifestSearch", json=body)
+        assert response.status_code == 200
+        identifiers += [package["PackageIdentifier"] for package in response.json["Data"]]
+        if "ContinuationToken" not in response.json:
+            break
+        body["ContinuationToken"] = response.json["ContinuationToken"]
+    assert identifiers == [f"Pub.App{number}" for number in range(5)]
+
+
+@pytest.mark.parametrize("token", ["not a token!", "bm90IGFuIGlk", 5, 1.5, ["MQ=="], {"id": 1}, True])
+def test_invalid_continuation_token(client, add_packages, token):
+    add_packages(1)
+    response = client.post("/wg/manifestSearch", json={"ContinuationToken": token})
+    assert response.status_code == 400